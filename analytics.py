@@ -0,0 +1,156 @@
+import argparse
+import json
+import mmap
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import config as cfg
+from batch import resolve_saves
+from utils.catalog import inflate_main_db
+from utils.columnar import ColumnStore, encode_table
+from utils.dbcache import DBCache
+from utils.header import parse_header, HeaderError
+from utils.script import read_db_header, MAIN_DB_NAME
+
+# Tables exported from every save by default: tyres, team performance per track, driver stats and team balances.
+TABLES = ('Tyres', 'Races_TeamPerformance', 'Staff_PerformanceStats', 'Finance_TeamBalance')
+STORE_NAME = 'analytics.f1c'
+
+
+def save_meta(path):
+    # -> (content key, db_section_off, main.db size, meta), the key is the same DB section hash the DB cache uses
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
+    try:
+        db_section_off, zlib_sz, db_sizes, _ = read_db_header(mm, path)
+        key = DBCache.key(mm, db_section_off, zlib_sz)
+        try:
+            properties = {prop['name']: prop['value'] for prop in parse_header(mm)['properties']}
+        except (HeaderError, UnicodeDecodeError):
+            properties = dict()
+    finally:
+        mm.close()
+    day = properties.get('Day')
+    meta = {
+        'name': os.path.basename(path),
+        'path': os.path.abspath(path),
+        'mtime': os.path.getmtime(path),
+        # in-game date where the save header has one
+        'day': day if isinstance(day, int) else None,
+    }
+    return key, db_section_off, db_sizes[0], meta
+
+
+def export_tables(path, db_section_off, main_size, tables):
+    # Pool entry point: inflates main.db only and encodes the tables -> {table: (table entry, members)}
+    exported = dict()
+    with tempfile.TemporaryDirectory(prefix='f1export-') as tmp_dir:
+        db_path = os.path.join(tmp_dir, MAIN_DB_NAME)
+        inflate_main_db(path, db_section_off, main_size, db_path)
+        con = sqlite3.connect(db_path)
+        try:
+            for table in tables:
+                try:
+                    cur = con.execute(f'SELECT * FROM {table};')
+                except sqlite3.OperationalError:
+                    continue  # not in this save
+                names = [column[0] for column in cur.description]
+                exported[table] = encode_table(names, cur.fetchall())
+        finally:
+            con.close()
+    return exported
+
+
+def export_saves(saves, store_path, tables=TABLES, jobs=None):
+    # Exports the saves whose content isn't in the store yet, in parallel -> (exported, skipped, failed)
+    store = ColumnStore(store_path)
+    pending = dict()
+    skipped = 0
+    for path in saves:
+        key, db_section_off, main_size, meta = save_meta(path)
+        if key in store or key in pending:
+            skipped += 1
+            continue
+        pending[key] = (path, db_section_off, main_size, meta)
+
+    segments = dict()
+    failed = list()
+    if pending:
+        with ProcessPoolExecutor(max_workers=min(jobs or os.cpu_count(), len(pending))) as pool:
+            futures = {key: pool.submit(export_tables, path, off, size, tables) for key, (path, off, size, _) in pending.items()}
+            for key, future in futures.items():
+                try:
+                    segments[key] = (pending[key][3], future.result())
+                except Exception as e:
+                    failed.append((pending[key][0], f'{type(e).__name__}: {e}'))
+        if segments:
+            store.write(segments)
+    store.close()
+    return len(segments), skipped, failed
+
+
+def parse_value(value):
+    # command line filters: numbers as numbers, anything else as text
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def print_aggregate(rows, agg, value):
+    groups = sorted({group for _, grouped in rows for group in grouped})
+    label = lambda group: '/'.join(map(str, group)) or f'{agg}({value})'
+    print(f"{'save':<28}{'day':>7}" + ''.join(f'{label(group):>14}' for group in groups))
+    for meta, grouped in rows:
+        cells = ''.join(f"{grouped[group]:>14.3f}" if group in grouped else f"{'':>14}" for group in groups)
+        print(f"{meta['name'][:27]:<28}{meta['day'] if meta['day'] is not None else '':>7}{cells}")
+
+
+if __name__ == '__main__':
+    # python analytics.py export "*.sav"
+    # python analytics.py query --table Staff_PerformanceStats --value Val --by StatID
+    # python analytics.py query --table Finance_TeamBalance --value Balance --by TeamID --agg sum
+    parser = argparse.ArgumentParser(description='Export tables of many saves into one columnar file and query them')
+    parser.add_argument('command', choices=['export', 'query', 'list'])
+    parser.add_argument('saves', nargs='*', help='export: save files or globs, relative ones are also looked up in the save folder')
+    parser.add_argument('--store', type=str, default=None, help=f'columnar file, defaults to <save folder>/{STORE_NAME}')
+    parser.add_argument('--tables', nargs='+', default=list(TABLES), help='export: tables pulled from every save')
+    parser.add_argument('--jobs', type=int, default=0, help='export: saves read at once, 0 for every core')
+    parser.add_argument('--table', type=str, help='query: table to aggregate')
+    parser.add_argument('--value', type=str, help='query: column to aggregate')
+    parser.add_argument('--by', nargs='*', default=[], help='query: columns to group by within each save')
+    parser.add_argument('--agg', type=str, default='mean', help='query: mean, sum, min, max or count')
+    parser.add_argument('--where', nargs='*', default=[], help='query: column=value filters')
+    ARGS = parser.parse_args()
+
+    store_path = ARGS.store or os.path.join(cfg.save_folder, STORE_NAME)
+    if ARGS.command == 'export':
+        _t = time.perf_counter()
+        saves = resolve_saves(ARGS.saves or ['*.sav'], cfg.save_folder)
+        exported, skipped, failed = export_saves(saves, store_path, ARGS.tables, ARGS.jobs)
+        for path, error in failed:
+            print(f"{os.path.basename(path)} failed: {error}")
+        print(f"Exported {exported} saves, {skipped} already in {store_path}, in {time.perf_counter() - _t:.2f}s")
+        raise SystemExit(1 if failed else 0)
+
+    store = ColumnStore(store_path)
+    if ARGS.command == 'list':
+        for meta in store.saves():
+            tables = ', '.join(f"{table} {entry['rows']}" for table, entry in meta['tables'].items())
+            print(f"{meta['name']:<28}{meta['day'] if meta['day'] is not None else '':>7}  {time.ctime(meta['mtime'])}  {meta['key'][:12]}  {tables}")
+    else:
+        if not ARGS.table or not ARGS.value:
+            parser.error('query needs --table and --value')
+        where = dict()
+        for spec in ARGS.where:
+            name, _, value = spec.partition('=')
+            where[name] = parse_value(value)
+        _t = time.perf_counter()
+        rows = store.aggregate(ARGS.table, ARGS.value, ARGS.by, agg=ARGS.agg, where=where)
+        elapsed = time.perf_counter() - _t
+        print_aggregate(rows, ARGS.agg, ARGS.value)
+        print(f"{len(rows)} saves in {elapsed * 1000:.1f} ms")
+    store.close()
@@ -0,0 +1,207 @@
+import argparse
+import contextlib
+import glob
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import config as cfg
+from main import SeasonChanger, MODIFIERS, add_season_args, season_kwargs_from_args, load_memory_db, serialize_memory_db
+from utils.savefile import SaveBackup, ExpectUnchanged
+from utils.script import process_unpack, process_repack, process_unpack_memory, process_repack_memory, read_db_header, \
+    MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME
+
+# Decompressed bytes allowed in flight across all workers by default.
+MEMORY_BUDGET = 2 << 30
+
+
+def resolve_saves(patterns, save_folder):
+    # Paths or globs, relative ones are looked up in the save folder when they don't exist as given.
+    saves = list()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or sorted(glob.glob(os.path.join(save_folder, pattern)))
+        if not matches:
+            raise FileNotFoundError(f'No save matches {pattern}')
+        saves.extend(os.path.abspath(match) for match in matches if os.path.abspath(match) not in saves)
+    return saves
+
+
+def decompressed_size(save_path):
+    # main.db + both backups as read from the size header, no inflating
+    with open(save_path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
+    try:
+        _, _, db_sizes, _ = read_db_header(mm, save_path)
+    finally:
+        mm.close()
+    return sum(db_sizes)
+
+
+def modify_save(save_path, output_path, work_dir, season_kwargs, modifiers=MODIFIERS, in_memory=True,
+                profile='scratch', level=-1, compress_workers=1, keep_backups=0, verify=True, expect=None):
+    # unpack -> modify -> repack for one save, everything it writes besides the output stays in work_dir
+    # expect: savefile.signature of output_path taken before the unpack, the output is only replaced
+    # while it still matches and SaveChanged is raised otherwise
+    timings = dict()
+    _t = time.perf_counter()
+    result_dir = os.path.join(work_dir, 'result')
+    os.makedirs(result_dir, exist_ok=True)
+    if in_memory:
+        unpacked = process_unpack_memory(save_path)
+        conn, wal = load_memory_db(unpacked.buffers[MAIN_DB_NAME])
+    else:
+        unpacked = process_unpack(save_path, result_dir, stream=True, selective=True)
+        conn = None
+    timings['unpack'] = time.perf_counter() - _t
+
+    _t = time.perf_counter()
+    season = SeasonChanger(db_path=os.path.join(result_dir, MAIN_DB_NAME), conn=conn, profile=profile, **season_kwargs)
+    season.run_modifiers(modifiers)
+    season.apply_plan()
+    season.commit(close=not in_memory)
+    timings['modify'] = time.perf_counter() - _t
+
+    _t = time.perf_counter()
+    before_replace = list()
+    if expect is not None:
+        before_replace.append(ExpectUnchanged(output_path, expect))
+    if os.path.abspath(output_path) == os.path.abspath(save_path):
+        # overwriting the save itself, keep its previous generations like main.py does
+        before_replace.append(SaveBackup(save_path, keep_backups))
+    if in_memory:
+        main_db = serialize_memory_db(season.conn, wal)
+        season.close_connection()
+        dbs = [main_db, unpacked.buffers[BACKUP_DB_NAME], unpacked.buffers[BACKUP_DB2_NAME]]
+        repacked = process_repack_memory(unpacked.chunk1, dbs, output_path, level, compress_workers, before_replace, verify)
+    else:
+        repacked = process_repack(result_dir, output_path, stream=True, chunk1=unpacked.chunk1, level=level, workers=compress_workers,
+                                  backups=unpacked.buffers, before_replace=before_replace, verify=verify)
+    timings['repack'] = time.perf_counter() - _t
+    if repacked.verified is not None:
+        # checked inside the repack, before the rename, reported on its own
+        timings['verify'] = sum(repacked.verified.timings.values())
+        timings['repack'] -= timings['verify']
+
+    return {
+        'writes': season.plan.stats.get('writes', 0),
+        'db_size': sum(unpacked.db_sizes.values()),
+        'zlib_size': repacked.zlib_size,
+        'timings': timings,
+    }
+
+
+def run_job(save_path, output_path, work_dir, season_kwargs, options):
+    # Pool entry point, the save's prints go to a log in its work dir instead of interleaving.
+    with open(os.path.join(work_dir, 'log.txt'), 'w') as log, contextlib.redirect_stdout(log):
+        return modify_save(save_path, output_path, work_dir, season_kwargs, **options)
+
+
+def run_batch(saves, season_kwargs, output_dir=None, jobs=None, memory_budget=MEMORY_BUDGET, keep_work=False, **options):
+    # Runs every save on a process pool, only starting a save while the decompressed bytes in flight
+    # fit the budget (a save bigger than the whole budget still runs, on its own).
+    jobs = jobs or os.cpu_count()
+    work_root = tempfile.mkdtemp(prefix='f1batch-')
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    pending = list()
+    report = list()
+    for i, save_path in enumerate(saves):
+        name = os.path.basename(save_path)
+        output_path = os.path.join(output_dir, name) if output_dir else save_path
+        try:
+            size = decompressed_size(save_path)
+        except Exception as e:
+            # empty, truncated or not a save at all, it fails on its own like a save failing in its job
+            report.append({'save': save_path, 'output': output_path, 'seconds': 0.0, 'ok': False,
+                           'error': f'{type(e).__name__}: {e}', 'work_dir': None})
+            continue
+        pending.append({
+            'save': save_path,
+            'output': output_path,
+            'work_dir': os.path.join(work_root, f'{i:03d}-{os.path.splitext(name)[0]}'),
+            'size': size,
+        })
+
+    running = dict()
+    in_flight = 0
+    _t = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            while pending and len(running) < jobs and (not running or in_flight + pending[0]['size'] <= memory_budget):
+                job = pending.pop(0)
+                os.makedirs(job['work_dir'])
+                job['started'] = time.perf_counter()
+                running[pool.submit(run_job, job['save'], job['output'], job['work_dir'], season_kwargs, options)] = job
+                in_flight += job['size']
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                in_flight -= job['size']
+                entry = {'save': job['save'], 'output': job['output'], 'seconds': time.perf_counter() - job['started']}
+                try:
+                    entry.update(future.result(), ok=True)
+                except Exception as e:
+                    entry.update(ok=False, error=f'{type(e).__name__}: {e}', work_dir=job['work_dir'])
+                if entry['ok'] and not keep_work:
+                    shutil.rmtree(job['work_dir'], ignore_errors=True)
+                report.append(entry)
+
+    if not keep_work and not os.listdir(work_root):
+        os.rmdir(work_root)
+    elapsed = time.perf_counter() - _t
+    return {
+        'ok': sum(entry['ok'] for entry in report),
+        'failed': sum(not entry['ok'] for entry in report),
+        'wall': elapsed,
+        'busy': sum(entry['seconds'] for entry in report),
+        'saves': sorted(report, key=lambda entry: saves.index(entry['save'])),
+    }
+
+
+def print_report(report):
+    for entry in report['saves']:
+        name = os.path.basename(entry['save'])
+        if entry['ok']:
+            stages = '  '.join(f'{stage} {seconds * 1000:.0f}ms' for stage, seconds in entry['timings'].items())
+            print(f"{name:<32}ok      {entry['seconds']:>8.2f}s  {entry['writes']:>8} writes  {stages}")
+        else:
+            see = f" (see {entry['work_dir']})" if entry['work_dir'] else ''
+            print(f"{name:<32}FAILED  {entry['seconds']:>8.2f}s  {entry['error']}{see}")
+    print(f"{report['ok']} ok, {report['failed']} failed in {report['wall']:.2f}s "
+          f"({report['busy']:.2f}s of save time, {report['busy'] / max(report['wall'], 1e-9):.1f}x)")
+
+
+if __name__ == '__main__':
+    # python batch.py "*.sav" --jobs 4 --output modded
+    parser = argparse.ArgumentParser(description='Apply one season profile to many saves in parallel')
+    parser.add_argument('saves', nargs='+', help='save files or globs, relative ones are also looked up in the save folder')
+    parser.add_argument('--output', type=str, default=None, help='write the modded saves to this folder instead of overwriting them')
+    parser.add_argument('--jobs', type=int, default=0, help='saves processed at once, 0 for every core')
+    parser.add_argument('--memory_budget', type=int, default=MEMORY_BUDGET >> 20, help='MiB of decompressed databases allowed in flight')
+    parser.add_argument('--on_disk', action='store_true', help='unpack to each save\'s work folder instead of keeping the databases in memory')
+    parser.add_argument('--keep_work', action='store_true', help='keep the per-save work folders (failed saves always keep theirs)')
+    parser.add_argument('--no_verify', action='store_true', help='skip re-reading every written save to check it')
+    parser.add_argument('--report', type=str, default=None, help='also write the report to this json file')
+    add_season_args(parser)
+    ARGS = parser.parse_args()
+
+    saves = resolve_saves(ARGS.saves, cfg.save_folder)
+    jobs = ARGS.jobs or os.cpu_count()
+    # 0 means every core here too, shared by the saves running at once
+    compress_workers = ARGS.compress_workers or max(1, os.cpu_count() // jobs)
+    report = run_batch(saves, season_kwargs_from_args(ARGS), output_dir=ARGS.output, jobs=jobs,
+                       memory_budget=ARGS.memory_budget << 20, keep_work=ARGS.keep_work,
+                       in_memory=not ARGS.on_disk, profile=ARGS.db_profile, level=ARGS.compress_level,
+                       compress_workers=compress_workers, keep_backups=cfg.save_backups,
+                       verify=not ARGS.no_verify)
+    print_report(report)
+    if ARGS.report:
+        with open(ARGS.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    raise SystemExit(1 if report['failed'] else 0)
@@ -1 +1,19 @@
-save_folder = r""
\ No newline at end of file
+save_folder = r""
+
+# Rollback snapshots (--save_season/--load_season): 'file' or 'redis'
+snapshot_backend = 'file'
+# defaults to <save_folder>/snapshots for the file backend
+snapshot_folder = r""
+# older snapshots are evicted
+snapshot_keep = 10
+redis_host = 'localhost'
+redis_port = 6379
+
+# Decompressed databases of recently unpacked saves, reused while the save is unchanged (--db_cache).
+# defaults to ~/.cache/f1manager22/dbs
+db_cache_folder = r""
+db_cache_size_mb = 1024
+
+# Generations of each save kept as <save>.bak1 (newest) .. <save>.bak<n> before it is overwritten, 0 to disable.
+# Reflinked or hardlinked where the filesystem allows it, copied otherwise.
+save_backups = 3
@@ -1,25 +1,37 @@
+import time
+
 import redis
-import pickle
+
 
 class ConRedis:
+    # Snapshot backend, every snapshot is one key plus an entry in a sorted set ordered by creation time.
+    prefix: str = 'f1m22:snapshot:'
+    index_key: str = 'f1m22:snapshots'
 
-    def __init__(self):
-        self.r = redis.Redis(host='localhost', port=6379, db=0,)
+    def __init__(self, host='localhost', port=6379, db=0, keep=10):
+        self.r = redis.Redis(host=host, port=port, db=db,)
+        self.keep = keep
 
-    def dump_object_to_redis(self, redis_key, obj):
-        # Serialize the object using pickle
-        serialized_object = pickle.dumps(obj)
+    def put(self, name, blob):
+        pipe = self.r.pipeline()
+        pipe.set(self.prefix + name, blob)
+        pipe.zadd(self.index_key, {name: time.time()})
+        pipe.execute()
+        self.evict()
 
-        # Store the serialized object in Redis
-        self.r.set(redis_key, serialized_object)
+    def get(self, name):
+        return self.r.get(self.prefix + name)
 
-    def retrieve_object_from_redis(self, redis_key):
-        # Retrieving the object from Redis
-        retrieved_object = self.r.get(redis_key)
+    def names(self):
+        # newest first
+        return [name.decode() for name in self.r.zrevrange(self.index_key, 0, -1)]
 
-        if retrieved_object is not None:
-            # Deserialize the object using pickle
-            deserialized_object = pickle.loads(retrieved_object)
-            return deserialized_object
-        else:
-            return None
+    def evict(self):
+        # drop everything older than the newest `keep` snapshots
+        old = self.r.zrange(self.index_key, 0, -(self.keep + 1))
+        if not old:
+            return
+        pipe = self.r.pipeline()
+        pipe.delete(*[self.prefix + name.decode() for name in old])
+        pipe.zrem(self.index_key, *old)
+        pipe.execute()
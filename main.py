@@ -1,21 +1,116 @@
 import sqlite3
 import os
 import json
-import enum
 import config as cfg
 import argparse
-import pickle
+import tempfile
+import time
+from tyres import TyreModel
+from ratings import DriverRatings, DEFAULT_RATINGS
+from parts import PartsBalance
+from staff import StaffRatings
+from plan import ChangePlan, Expr
+from snapshots import SnapshotStore, db_fingerprint, open_backend
+from utils.catalog import SaveCatalog, format_entry
+from utils.dbcache import DBCache, CACHE_DIR
+from utils.instrument import Instrument
+from utils.savefile import SaveBackup, backup_path
+from utils.verify import VerifyError
+from utils.script import process_unpack, process_repack, process_unpack_memory, process_repack_memory, dump_unpacked, MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME
+
+# The unpacked main.db is a throwaway copy rebuilt from the save on every run,
+# so durability is traded for speed. Savepoints still need a rollback journal, kept in memory.
+DB_PROFILES = {
+    'default': (),
+    'scratch': (
+        'PRAGMA synchronous = OFF;',
+        'PRAGMA cache_size = -65536;',
+        'PRAGMA temp_store = MEMORY;',
+        'PRAGMA locking_mode = EXCLUSIVE;',
+    ),
+}
+
+# SeasonChanger methods run by main.py, in order.
+MODIFIERS = [
+    'balance_parts',
+    'equal_track_stats',
+    'calculate_dirty_air',
+    'calculate_tyres',
+    'set_drs',
+    'set_slipstream',
+    'generate_ratings',
+    'set_driver_data',
+    'team_cash_infusion',
+]
+
+# sqlite file header bytes 18/19, 2 means WAL which a deserialized database can't open.
+WAL_HEADER = b'\x02\x02'
+LEGACY_HEADER = b'\x01\x01'
+
+
+def load_memory_db(data):
+    # Loads a database image into an in-memory connection, returns it with the WAL flag to restore later.
+    wal = bytes(data[18:20]) == WAL_HEADER
+    if wal:
+        data = bytearray(data)
+        data[18:20] = LEGACY_HEADER
+
+    con = sqlite3.connect(':memory:')
+    if hasattr(con, 'deserialize'):
+        con.deserialize(data)
+        return con, wal
+
+    # python < 3.11 has no deserialize, go through a temporary file instead
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = os.path.join(tmp_dir, MAIN_DB_NAME)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        src = sqlite3.connect(tmp_path)
+        src.backup(con)
+        src.close()
+    return con, wal
+
+
+def serialize_memory_db(con, wal=False):
+    if hasattr(con, 'serialize'):
+        data = con.serialize()
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_path = os.path.join(tmp_dir, MAIN_DB_NAME)
+            dst = sqlite3.connect(tmp_path)
+            con.backup(dst)
+            dst.close()
+            with open(tmp_path, 'rb') as f:
+                data = f.read()
+
+    if wal:
+        data = bytearray(data)
+        data[18:20] = WAL_HEADER
+    return data
+
 
 class DBConnector:
-    def __init__(self, db_path):
+    def __init__(self, db_path, conn=None, profile='default'):
         self.db_path = db_path
-        self.cur, self.conn = self.connect()
+        self.profile = profile
+        self.cur, self.conn = self.connect(conn)
 
-    def connect(self):
-        con = sqlite3.connect(self.db_path)
+    def connect(self, conn=None):
+        # An already open connection (e.g. an in-memory copy of main.db) can be handed over.
+        con = conn if conn is not None else sqlite3.connect(self.db_path)
         cur = con.cursor()
+        for pragma in DB_PROFILES[self.profile]:
+            cur.execute(pragma)
+        if self.profile != 'default':
+            # switching a WAL database away from WAL would rewrite its header, leave those alone
+            if cur.execute('PRAGMA journal_mode;').fetchone()[0] != 'wal':
+                cur.execute('PRAGMA journal_mode = MEMORY;')
         return cur, con
 
+    def begin(self):
+        if not self.conn.in_transaction:
+            self.cur.execute('BEGIN;')
+
     def execute_many(self, query, values):
         return self.cur.executemany(query, values)
 
@@ -25,29 +120,16 @@ class DBConnector:
     def execute_value(self, query, value):
         return self.cur.execute(query, value)
 
-    def commit(self):
+    def commit(self, close=True):
         self.conn.commit()
-        self.close_connection()
+        if close:
+            self.close_connection()
 
     def close_connection(self):
         self.cur.close()
         self.conn.close()
 
 
-class DriverStats(enum.Enum):
-
-    Cornering = 2
-    Braking = 3
-    Control = 4
-
-    Smoothness = 5
-    Adaptability = 6
-    Overtaking = 7
-
-    Defence = 8
-    Acceleration = 9
-    Accuracy = 10
-
 class SeasonChanger(DBConnector):
     race_perf_table: str = 'Parts_RaceSimConstants'
     tyres_table: str = 'Tyres'
@@ -60,8 +142,8 @@ class SeasonChanger(DBConnector):
     pit_crew: str = 'Staff_PitCrew_PerformanceStats'
     team_expertise: str = 'Parts_TeamExpertise'
 
-    def __init__(self, db_path: str, base_tyre_life: int, base_perf: int, tyre3set_perf_diff: float, tyre3set_life_diff: float, dirty_air: float, drs: float, slipstream: float, f1_cfg=cfg):
-        super().__init__(db_path)
+    def __init__(self, db_path: str, base_tyre_life: int, base_perf: int, tyre3set_perf_diff: float, tyre3set_life_diff: float, dirty_air: float, drs: float, slipstream: float, tyre_params: dict = None, tyre_steps: dict = None, driver_ratings: DriverRatings = None, parts_balance: PartsBalance = None, staff_ratings: StaffRatings = None, f1_cfg=cfg, conn=None, profile='default', instrument: Instrument = None):
+        super().__init__(db_path, conn, profile)
         self.base_tyre_life = base_tyre_life
         self.base_perf = base_perf
         self.tyre3set_perf_diff = tyre3set_perf_diff
@@ -69,29 +151,71 @@ class SeasonChanger(DBConnector):
         self.dirty_air = dirty_air
         self.drs = drs
         self.slipstream = slipstream
+        self.tyre_params = tyre_params or {}
+        self.tyre_steps = tyre_steps
+        self.driver_ratings = driver_ratings
+        self.parts_balance = parts_balance or PartsBalance()
+        self.staff_ratings = staff_ratings
         self.f1_cfg = cfg
+        self.timings = dict()
+        # statement/row counts per modifier only when the caller passes its own instrument (main.py with --report),
+        # the counter's trace callback and progress handler cost on every statement
+        self.instrument = instrument or Instrument()
+        if instrument is not None:
+            instrument.attach(self.conn)
+        # modifiers only record their writes here, apply_plan() executes what survives
+        self.plan = ChangePlan()
+
+    def run_modifier(self, name: str):
+        # Each modifier gets its own savepoint inside the run's transaction, a failure only undoes its own writes.
+        self.begin()
+        self.cur.execute(f'SAVEPOINT {name};')
+        mark = self.plan.mark()
+        with self.instrument.stage(name) as stage:
+            try:
+                getattr(self, name)()
+                # a missing table or column fails here, inside the savepoint, not when the plan is applied
+                self.plan.check(self, mark)
+            except Exception as e:
+                self.cur.execute(f'ROLLBACK TO {name};')
+                self.plan.truncate(mark)
+                stage['error'] = repr(e)
+                print(f"{name} failed and was rolled back: {e!r}")
+            finally:
+                self.cur.execute(f'RELEASE {name};')
+            stage['planned'] = len(self.plan.entries) - mark
+        self.timings[name] = stage['wall']
+
+    def run_modifiers(self, names: list) -> dict:
+        for name in names:
+            self.run_modifier(name)
+        return self.timings
+
+    def apply_plan(self, dry_run=False, detailed=False):
+        # detailed: also record the before/after value of every changed cell, needed for the dry run diff and snapshots
+        with self.instrument.stage('apply_plan') as stage:
+            self.begin()
+            if dry_run:
+                self.cur.execute('SAVEPOINT dry_run;')
+            self.plan.apply(self, record=dry_run or detailed)
+            if dry_run:
+                self.cur.execute('ROLLBACK TO dry_run;')
+                self.cur.execute('RELEASE dry_run;')
+        self.timings['apply_plan'] = stage['wall']
+        if dry_run:
+            self.plan.print_diff()
+            return self.plan.stats
+        print("Change plan applied", self.plan.stats)
+        return self.plan.stats
 
     def get_tyre_life(self):
         query = 'SELECT Durability FROM tyres LIMIT 5;'
         return self.execute(query)
 
-    def set_tyre_life(self, values: list):
-        query = f'UPDATE {self.tyres_table} SET Durability = ? WHERE Type = ?;'
-        for i, value in enumerate(values):
-            params = (value, i)
-            self.execute_value(query, params)
-
     def get_tyre_performance(self):
         query = 'SELECT grip FROM tyres LIMIT 5;'
         return self.execute(query)
 
-    def set_tyre_performance(self, values: list):
-        query = f'UPDATE {self.tyres_table} SET grip = ? WHERE Type = ?;'
-        values.reverse()
-        for i, value in enumerate(values):
-            params = (value, i )
-            self.execute_value(query, params)
-
     def get_dirty_air(self, base_params: str) -> dict:
         columns = ','.join([x for x in base_params['dirty_air']])
         query = f'SELECT {columns} FROM {self.race_perf_table}'
@@ -99,126 +223,31 @@ class SeasonChanger(DBConnector):
         return query_results
 
     def set_dirty_air(self, base_params: dict):
-        for x in base_params['dirty_air']:
-            query = f'UPDATE {self.race_perf_table} SET {x} = ?;'
-            value = base_params['dirty_air'][x]
-            self.execute_value(query, (value,))
+        self.plan.update(self.race_perf_table, base_params['dirty_air'])
 
     def get_drs(self,):
         query = f"SELECT MaxDRSTopSpeedMultiplier FROM {self.race_perf_table};"
         return self.execute(query)
 
     def set_drs(self):
-        # set drs multiplier
-        query = f"UPDATE {self.race_perf_table} SET MaxDRSTopSpeedMultiplier = ?;"
-        value = str(self.drs)
-        self.execute_value(query, (value,))
-        # set acceleration multiplier
-        query = f"UPDATE {self.race_perf_table} SET MaxDRSAccelerationMultiplier = ?;"
-        value = str(self.drs * 1.15)
+        value = self.drs * 1.15
         print("Accerellation set", value)
-        self.execute_value(query, (value,))
-        # set acceleration multiplier
-        query = f"UPDATE {self.race_perf_table} SET MinDRSAccelerationMultiplier = ?;"
-        value = str(1)
-        self.execute_value(query, (value,))
+        self.plan.update(self.race_perf_table, {
+            # set drs multiplier
+            'MaxDRSTopSpeedMultiplier': self.drs,
+            # set acceleration multiplier
+            'MaxDRSAccelerationMultiplier': value,
+            'MinDRSAccelerationMultiplier': 1.0,
+        })
 
     def get_slipstream(self):
         query = f"SELECT DirtyAirStraightSpeedMultiplier FROM {self.race_perf_table};"
         return self.execute(query)
 
     def set_slipstream(self):
-        query = f'UPDATE {self.race_perf_table} SET DirtyAirStraightSpeedMultiplier = ?;'
-        value = str(self.slipstream)
-        self.execute_value(query, (value,))
+        self.plan.update(self.race_perf_table, {'DirtyAirStraightSpeedMultiplier': self.slipstream})
         print("Slipstream set")
 
-    def set_temp_increase_rate(self, base_params):
-        query = f'UPDATE {self.tyres_table} SET TempIncRate = ? WHERE Type = ?;'
-        for i in range(5):
-            params = (base_params['TempIncRate'] + (i / 20), i)
-            self.cur.execute(query, params)
-
-    def set_temp_decrease_rate(self, base_params):
-        query = f'UPDATE {self.tyres_table} SET TempDecRate = ? WHERE Type = ?;'
-        for i in range(5):
-            params = (base_params['TempDecRate'] + (i / 25), i)
-            self.cur.execute(query, params)
-
-    def set_min_extreme_wear(self, base_params):
-        query = f'UPDATE {self.tyres_table} SET MinExtremeWear = ? WHERE Type = ?;'
-        for i in range(5):
-            params = (base_params['MinExtremeWear'] + (i / 30), i)
-            self.cur.execute(query, params)
-
-    def set_max_extreme_wear(self, base_params):
-        query = f'UPDATE {self.tyres_table} SET MaxExtremeWear = ? WHERE Type = ?;'
-        for i in range(5):
-            params = (base_params['MaxExtremeWear'] + (i / 100), i)
-            self.cur.execute(query, params)
-
-    def set_min_optimal_wear(self, base_params):
-        query = f'UPDATE {self.tyres_table} SET MinOptimalWear = ? WHERE Type = ?;'
-        for i in range(5):
-            params = (base_params['MinOptimalWear'] + (i / 30), i)
-            self.cur.execute(query, params)
-
-    def set_max_optimal_wear(self, base_params):
-        query = f'UPDATE {self.tyres_table} SET MaxOptimalWear = ? WHERE Type = ?;'
-        for i in range(5):
-            params = (base_params['MaxOptimalWear'] + (i / 100), i)
-            self.cur.execute(query, params)
-
-    def set_min_optimal_grip(self, base_params):
-        query = f'UPDATE {self.tyres_table} SET MinOptimalGrip = ? WHERE Type = ?;'
-        for i in range(5):
-            params = (base_params['MinOptimalGrip'] + (i / 7.5), i)
-            self.cur.execute(query, params)
-
-    def set_max_optimal_grip(self, base_params):
-        query = f'UPDATE {self.tyres_table} SET MaxOptimalGrip = ? WHERE Type = ?;'
-        for i in range(5):
-            params = (base_params['MaxOptimalGrip'] + (i / 10), i)
-            self.cur.execute(query, params)
-
-    def set_min_extreme_grip(self, base_params):
-        query = f'UPDATE {self.tyres_table} SET MinExtremeGrip = ? WHERE Type = ?;'
-        for i in range(5):
-            params = (base_params['MinExtremeGrip'] + (i / 20), i)
-            self.cur.execute(query, params)
-
-    def set_max_extreme_grip(self, base_params):
-        query = f'UPDATE {self.tyres_table} SET MaxExtremeGrip = ? WHERE Type = ?;'
-        for i in range(5):
-            params = (base_params['MaxExtremeGrip'] + (i / 15), i)
-            self.cur.execute(query, params)
-
-    def set_tyre_tempswear(self, base_params):
-        columns = ' = ?, '.join([x for x in base_params])
-        values = tuple([base_params[x] for x in base_params])
-        query = f"UPDATE {self.tyres_table} SET {columns} = ?;"
-        self.execute_many(query, [values])
-
-    def calculate_tyre_life(self):
-        perf_range = self.tyre3set_life_diff
-        base_modifier = self.base_tyre_life
-        perf_mult = perf_range / 3
-        values = [base_modifier]
-        for i in range(1,5):
-            values.append(base_modifier - (perf_mult * i))
-        self.set_tyre_life(values)
-        print("Tyre life values set")
-
-    def calculate_tyre_performance(self):
-        perf_range = self.tyre3set_perf_diff
-        base_modifier = self.base_perf
-        perf_mult = perf_range / 3
-        values = [base_modifier]
-        for i in range(1,5):
-            values.append(base_modifier - (perf_mult * i))
-        self.set_tyre_performance(values)
-        print("Tyre performance values set")
-
     def calculate_dirty_air(self):
         perf_range = self.dirty_air
         if not perf_range > 0:
@@ -245,56 +274,34 @@ class SeasonChanger(DBConnector):
         self.set_dirty_air(base_params)
         print("Dirty air values set")
 
-    def calculate_tyre_tempswear(self):
-        base_params = {'TempIncRate': ARGS.temp_inc_rate, 'TempDecRate':ARGS.temp_dec_rate, 'MinExtremeWear': ARGS.min_extreme_wear, 'MaxExtremeWear': ARGS.max_extreme_wear,
-                       'MinOptimalWear': ARGS.min_optimal_wear, 'MaxOptimalWear': ARGS.max_optimal_wear, 'MinOptimalGrip': ARGS.min_optimal_grip, 'MaxOptimalGrip': ARGS.max_optimal_grip,
-                       'MinExtremeGrip': ARGS.min_extreme_grip, 'MaxExtremeGrip': ARGS.max_extreme_grip}
-
-        self.set_tyre_tempswear(base_params)
-        # tyre wear increases when in extreme temp range
-        self.set_max_extreme_wear(base_params)
-        self.set_min_extreme_wear(base_params)
-        # tyre wear decreases when in extreme temp range
-        self.set_max_optimal_wear(base_params)
-        self.set_min_optimal_wear(base_params)
-        # tyre grip increases when in optimal temp range
-        self.set_max_optimal_grip(base_params)
-        self.set_min_optimal_grip(base_params)
-        # grip falls off when tyres is overheating
-        self.set_max_extreme_grip(base_params)
-        self.set_min_extreme_grip(base_params)
-        # tyres heat up faster and cool down faster depending on tyre compound
-        self.set_temp_increase_rate(base_params)
-        self.set_temp_decrease_rate(base_params)
-        print("Tyre tempswear values set")
-
-
-    def set_driver_data(self):
-        driver_stat_dict = dict(DriverStats.__members__)
+    def tyre_model(self) -> TyreModel:
+        return TyreModel(self.base_tyre_life, self.base_perf, self.tyre3set_life_diff, self.tyre3set_perf_diff,
+                         self.tyre_params, self.tyre_steps)
 
-        my_dir = os.path.join(os.getcwd(), 'drivers', 'F1_22.json')
-        with open(my_dir, 'r') as f:
-            data = json.load(f)
+    def calculate_tyres(self):
+        # tyre life, grip and the temperature/wear window for every compound
+        self.tyre_model().add_to_plan(self.plan)
+        print("Tyre values set")
 
-        for x in data:
-            _id = f'[DriverCode_{x["ID"].lower().capitalize()}]'
-            query = f"SELECT StaffID FROM {self.drivers_table} WHERE DriverCode = ?;"
-            staff_id = self.execute_value(query, (_id,)).fetchone()[0]
-            stats = dict(list(x.items())[2:])
+    def generate_ratings(self):
+        # procedural ratings for every driver and pit crew member, the JSON ratings are layered on top after this
+        if self.staff_ratings is None:
+            return
+        for table, rows in self.staff_ratings.add_to_plan(self, self.plan).items():
+            print(f"Generated {rows} ratings in {table}")
 
-            for y in stats:
-                y = y.capitalize()
-                query = f"UPDATE {self.drivers_stats} SET Val = ? WHERE StaffID = ? and StatID = ? ;"
-                value = stats[y.lower()]
-                stat_id = driver_stat_dict[y].value
-                self.execute_value(query, (value, staff_id, stat_id))
+    def set_driver_data(self):
+        if self.driver_ratings is None:
+            self.driver_ratings = DriverRatings()
+        _, unknown = self.driver_ratings.add_to_plan(self, self.plan)
+        for code in unknown:
+            print(f"Driver {code} not found in {self.drivers_table}, skipped")
 
         print("Driver stats set")
 
     def team_cash_infusion(self):
         # jeff bezos and elon musk decide to give each team half a billion dollars
-        query = f"UPDATE {self.teams_finances} SET Balance = Balance + 500000000;"
-        self.execute(query)
+        self.plan.update(self.teams_finances, {'Balance': Expr('{} + ?', 500000000)})
         print("Team cash infusion complete")
 
     def calculate_tyre_strategy(self):
@@ -302,96 +309,49 @@ class SeasonChanger(DBConnector):
 
         pass
 
-    def equal_engines(self):
-        base_unit_value = 100
-        base_value = 1000
-
-        # Get engine design IDs
-        query = f"SELECT EngineDesignID, ErsDesignID, GearboxDesignID FROM {self.engine_manufacturers};"
-        design_ids = self.execute(query)
-        print('design ids', design_ids)
-
-        update_queries = []
-        values = []
-
-        for design_id in design_ids:
-            engine_design_id, ers_design_id, gearbox_design_id = design_id
-
-            # Update engine design stats
-            update_queries.append(
-                f"UPDATE {self.design_stats} SET UnitValue = ?, Value = ? WHERE DesignID = ? AND StatID IN (SELECT StatID FROM Parts_DesignStatValues WHERE DesignID = ?);")
-            values.append((base_unit_value, base_value, engine_design_id, engine_design_id))
-
-            # Update ERS design stats
-            update_queries.append(
-                f"UPDATE {self.design_stats} SET UnitValue = ?, Value = ? WHERE DesignID = ? AND StatID IN (SELECT StatID FROM Parts_DesignStatValues WHERE DesignID = ?);")
-            values.append((base_unit_value, base_value, ers_design_id, ers_design_id))
-
-            # Update gearbox design stats
-            update_queries.append(
-                f"UPDATE {self.design_stats} SET UnitValue = ?, Value = ? WHERE DesignID = ? AND StatID IN (SELECT StatID FROM Parts_DesignStatValues WHERE DesignID = ?);")
-            values.append((base_unit_value, base_value, gearbox_design_id, gearbox_design_id))
-
-        for update_query, value in zip(update_queries, values):
-            print(update_query, value)
-            self.execute_value(update_query, value)
-
-    def update_design_stats(self, design_id, unit_value, value):
-        query = "SELECT DesignID, StatID FROM Parts_DesignStatValues WHERE DesignID = ?"
-        results = self.execute_value(query, (design_id,)).fetchall()
-
-        update_queries = []
-        values = []
-
-        for result in results:
-            design_id, stat_id = result
-
-            # Update UnitValue in Parts_DesignStatValues
-            update_queries.append(f"UPDATE {self.design_stats} SET UnitValue = ? WHERE DesignID = ? AND StatID = ?;")
-            values.append((unit_value, design_id, stat_id))
-
-            # Update Value in Parts_DesignStatValues
-            update_queries.append(f"UPDATE {self.design_stats} SET Value = ? WHERE DesignID = ? AND StatID = ?;")
-            values.append((value, design_id, stat_id))
-
-        self.execute_many(update_queries, values)
-        self.commit()
-
-    def equal_stats(self):
-        base_unit_value = 25
-        base_value = base_unit_value * 10
-
-        query = f"UPDATE {self.design_stats} SET UnitValue = ?, Value = ?;"
-        values = (base_unit_value, base_value)
-        self.execute_value(query, values)
-
+    def balance_parts(self):
+        # chassis designs, then the engine/ERS/gearbox designs, then the team handicaps, see parts.py
+        self.parts_balance.add_to_plan(self.plan)
 
     def equal_track_stats(self):
-        query = f"UPDATE {self.track_perf} SET Straights = 1.0, SlowCorners = 1.0, FastCorners = 1.0, MediumCorners = 1.0;"
-        self.execute(query)
+        self.plan.update(self.track_perf, {'Straights': 1.0, 'SlowCorners': 1.0, 'FastCorners': 1.0, 'MediumCorners': 1.0})
 
     def equal_pit_crew(self):
-        query = f"UPDATE {self.pit_crew} SET Val = 100.0;"
-        self.execute(query)
+        self.plan.update(self.pit_crew, {'Val': 100.0})
 
     def equal_expertise(self):
         expertise = 1000
-        query = f"UPDATE {self.team_expertise} SET Expertise = {expertise}, SeasonStartExpertise = {expertise};"
-        self.execute(query)
+        self.plan.update(self.team_expertise, {'Expertise': expertise, 'SeasonStartExpertise': expertise})
 
     def driver_buffs(self):
         val = 100
-        query = f"UPDATE {self.drivers_table} SET Improvability = {val}, Aggression = {val};"
-        self.execute(query)
-
-
-def pack_object(obj):
-    return pickle.dumps(obj)
-
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='F1 2021 Season Changer')
-    parser.add_argument('--save', type=str, default='autosave.sav', help='the name of the save to extract from and overwrite')
+        self.plan.update(self.drivers_table, {'Improvability': val, 'Aggression': val})
+
+
+def compare_profiles(main_db, season_kwargs, modifiers=MODIFIERS):
+    # Runs the modifiers on a scratch copy of main.db once per profile and prints the timings side by side.
+    timings = dict()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for profile in DB_PROFILES:
+            db_path = os.path.join(tmp_dir, f'{profile}.db')
+            with open(db_path, 'wb') as f:
+                f.write(main_db)
+            season = SeasonChanger(db_path=db_path, profile=profile, **season_kwargs)
+            season.run_modifiers(modifiers)
+            season.apply_plan()
+            _t = time.perf_counter()
+            season.commit()
+            season.timings['commit'] = time.perf_counter() - _t
+            timings[profile] = season.timings
+
+    print(f"{'modifier':<24}" + ''.join(f'{profile:>12}' for profile in timings))
+    for name in timings['default']:
+        print(f'{name:<24}' + ''.join(f'{timings[profile][name] * 1000:>10.2f}ms' for profile in timings))
+    return timings
+
+
+def add_season_args(parser):
+    # SeasonChanger and repack settings, shared by every entry point that mods saves
     parser.add_argument('--base_tl', type=float, default=1.25, help='base tyre life')
     parser.add_argument('--base_perf', type=float, default=1.0, help='base tyre performance')
     parser.add_argument('--tperf_diff', type=float, default=0.40, help='base tyre performance')
@@ -409,52 +369,193 @@ if __name__ == '__main__':
     parser.add_argument('--max_optimal_grip', type=float, default=0.85, help='max tyre grip in optimal temp range')
     parser.add_argument('--min_extreme_grip', type=float, default=0.45, help='min tyre grip in extreme temp range')
     parser.add_argument('--max_extreme_grip', type=float, default=0.70, help='max tyre grip in extreme temp range')
-    parser.add_argument('--load_season', type=str, default=None, help='load a previous instance you created from redis')
-    parser.add_argument('--save_season', type=str, default=None, help='save the current instance to redis')
+    parser.add_argument('--tyre_steps', type=str, default=None, help='json object of per-compound steps overriding the defaults, e.g. \'{"TempIncRate": 10}\'')
+    parser.add_argument('--ratings', type=str, nargs='+', default=[DEFAULT_RATINGS], help='driver rating json files, later files override earlier ones')
+    parser.add_argument('--staff_rules', type=str, default=None, help='json rules generating ratings for every driver and pit crew member before --ratings is applied')
+    parser.add_argument('--parts', type=str, default=None, help='parts balance json file with design values, per-stat targets and team handicaps')
 
     parser.add_argument('--drs', type=float, default=1.05, help='Drs performance')
     parser.add_argument('--slipstream', type=float, default=1.0005, help='slipstream performance')
+    parser.add_argument('--db_profile', type=str, default='scratch', choices=list(DB_PROFILES), help='sqlite settings used on the unpacked main.db')
+    parser.add_argument('--compress_level', type=int, default=-1, help='zlib level used when repacking the save')
+    parser.add_argument('--compress_workers', type=int, default=1, help='deflate threads used when repacking, 0 for every core')
+    return parser
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='F1 2021 Season Changer')
+    parser.add_argument('--save', type=str, default='autosave.sav', help='the name of the save to extract from and overwrite')
+    parser.add_argument('--list_saves', action='store_true', help='list every save in the save folder from the catalog and exit')
+    add_season_args(parser)
+    parser.add_argument('--tyre_preview', action='store_true', help='print the tyre compound matrix and exit without touching the save')
+    parser.add_argument('--tyre_export', type=str, default=None, help='write the tyre compound matrix to this json file')
+    parser.add_argument('--load_season', type=str, default=None, help='roll the save back to before the run stored as this snapshot')
+    parser.add_argument('--save_season', type=str, default=None, help='store the changes of this run as a snapshot you can roll back to')
+    parser.add_argument('--force', action='store_true', help='with --load_season, restore into a save the snapshot was not taken from, or that changed since')
+    parser.add_argument('--snapshot_backend', type=str, default=None, choices=['file', 'redis'], help='where snapshots live, defaults to config.snapshot_backend')
+    parser.add_argument('--in_memory', action='store_true', help='keep the unpacked databases in memory instead of the result folder')
+    parser.add_argument('--full_unpack', action='store_true', help='also write backup1.db/backup2.db to the result folder, by default only main.db is written')
+    parser.add_argument('--db_cache', action='store_true', help='cache the inflated databases and reuse them for an identical save, pays off for reruns on the same save (e.g. after --dry_run)')
+    parser.add_argument('--debug', action='store_true', help='with --in_memory, still write the intermediate files to the result folder')
+    parser.add_argument('--compare_profiles', action='store_true', help='time every modifier under each db profile on a copy of main.db and exit')
+    parser.add_argument('--no_verify', action='store_true', help='skip re-reading the new save to check its zlib stream, sizes and main.db before it replaces the old one')
+    parser.add_argument('--dry_run', action='store_true', help='print the changes against the current save without writing them')
+    parser.add_argument('--report', type=str, default=None, help='write a json report of per-stage time, sql counts and peak memory to this file')
+    parser.add_argument('--cprofile', action='store_true', help='with --report, also profile the run with cProfile (<report>.prof)')
+    parser.add_argument('--trace_memory', action='store_true', help='with --report, also trace python allocations with tracemalloc')
+    return parser
+
+
+def tyre_params_from_args(args) -> dict:
+    return {'TempIncRate': args.temp_inc_rate, 'TempDecRate': args.temp_dec_rate, 'MinExtremeWear': args.min_extreme_wear, 'MaxExtremeWear': args.max_extreme_wear,
+            'MinOptimalWear': args.min_optimal_wear, 'MaxOptimalWear': args.max_optimal_wear, 'MinOptimalGrip': args.min_optimal_grip, 'MaxOptimalGrip': args.max_optimal_grip,
+            'MinExtremeGrip': args.min_extreme_grip, 'MaxExtremeGrip': args.max_extreme_grip}
+
+
+def season_kwargs_from_args(args) -> dict:
+    # SeasonChanger arguments, see add_season_args
+    return dict(base_tyre_life=args.base_tl,
+                base_perf=args.base_perf,
+                tyre3set_perf_diff=args.tperf_diff,
+                tyre3set_life_diff=args.tlife_diff,
+                dirty_air=args.dirty_air,
+                drs=args.drs,
+                slipstream=args.slipstream,
+                tyre_params=tyre_params_from_args(args),
+                tyre_steps=json.loads(args.tyre_steps) if args.tyre_steps else None,
+                driver_ratings=DriverRatings(args.ratings),
+                parts_balance=PartsBalance.from_file(args.parts) if args.parts else None,
+                staff_ratings=StaffRatings.from_file(args.staff_rules) if args.staff_rules else None,)
+
+
+if __name__ == '__main__':
+    parser = build_parser()
     ARGS = parser.parse_args()
+    if (ARGS.cprofile or ARGS.trace_memory) and not ARGS.report:
+        parser.error('--cprofile and --trace_memory only go into the --report file, pass --report too')
+
+    tyre_params = tyre_params_from_args(ARGS)
+    tyre_steps = json.loads(ARGS.tyre_steps) if ARGS.tyre_steps else None
+
+    if ARGS.tyre_preview or ARGS.tyre_export:
+        tyre_model = TyreModel(ARGS.base_tl, ARGS.base_perf, ARGS.tlife_diff, ARGS.tperf_diff, tyre_params, tyre_steps)
+        if ARGS.tyre_export:
+            tyre_model.export(ARGS.tyre_export)
+            print("Tyre matrix exported to", ARGS.tyre_export)
+        if ARGS.tyre_preview:
+            print(tyre_model.preview())
+            raise SystemExit(0)
 
     # save folder location
     save_folder = cfg.save_folder
+    if ARGS.list_saves:
+        catalog = SaveCatalog()
+        catalog.refresh(save_folder)
+        for entry in catalog.saves(save_folder):
+            print(format_entry(entry))
+        for path, error in catalog.unreadable.items():
+            print(f"{os.path.basename(path):<32}unreadable, skipped: {error}")
+        catalog.close()
+        raise SystemExit(0)
+
+    compress_workers = ARGS.compress_workers or os.cpu_count()
     db_dir = os.path.join(save_folder, 'result', 'main.db')
 
     #xAranaktu script to unpack to extract autosave
-    script_dir = os.path.join(os.getcwd(), 'utils', 'script.py')
     result_dir = os.path.join(save_folder, 'result')
-    autosave_dir = os.path.join(save_folder, 'autosave.sav')
-    os_cmd = f'python "{script_dir}" --operation unpack --input "{autosave_dir}" --result "{result_dir}"'
-    os.system(os_cmd)
-    print("Unpacked autosave")
+    autosave_dir = os.path.join(save_folder, ARGS.save)
+    # opt-in: the save is overwritten at the end of a normal run, so its entry only hits again if the old save comes back
+    db_cache = DBCache(cfg.db_cache_folder or CACHE_DIR, cfg.db_cache_size_mb << 20) if ARGS.db_cache else None
+    instrument = Instrument(profile=ARGS.cprofile, trace_memory=ARGS.trace_memory).start()
+    with instrument.stage('unpack'):
+        if ARGS.in_memory:
+            unpacked = process_unpack_memory(autosave_dir, db_cache)
+            if ARGS.debug:
+                dump_unpacked(unpacked, result_dir)
+            main_conn, main_wal = load_memory_db(unpacked.buffers[MAIN_DB_NAME])
+        else:
+            unpacked = process_unpack(autosave_dir, result_dir, stream=True, cache=db_cache, selective=not ARGS.full_unpack)
+            main_conn = None
+    instrument.add('unpack', unpacked.timings)
+    print("Unpacked autosave", unpacked)
 
     # example
-    season_v1 = SeasonChanger(db_path=db_dir,
-                              base_tyre_life=ARGS.base_tl,
-                              base_perf=ARGS.base_perf,
-                              tyre3set_perf_diff=ARGS.tperf_diff,
-                              tyre3set_life_diff=ARGS.tlife_diff,
-                              dirty_air=ARGS.dirty_air,
-                              drs=ARGS.drs,
-                              slipstream=ARGS.slipstream,)
-
-    # # calculate new values and assign them to the database
-    season_v1.equal_stats()
-    season_v1.equal_track_stats()
-    season_v1.equal_engines()
-    season_v1.calculate_dirty_air()
-    season_v1.calculate_tyre_performance()
-    season_v1.calculate_tyre_life()
-    season_v1.calculate_tyre_tempswear()
-    season_v1.set_drs()
-    season_v1.set_slipstream()
-    season_v1.set_driver_data()
-    season_v1.team_cash_infusion()
-    season_v1.commit()
+    season_kwargs = season_kwargs_from_args(ARGS)
+
+    if ARGS.compare_profiles:
+        main_db = unpacked.buffers[MAIN_DB_NAME] if ARGS.in_memory else open(db_dir, 'rb').read()
+        compare_profiles(main_db, season_kwargs)
+        raise SystemExit(0)
+
+    season_v1 = SeasonChanger(db_path=db_dir, conn=main_conn, profile=ARGS.db_profile,
+                              instrument=instrument if ARGS.report else None, **season_kwargs)
+
+    snapshots = SnapshotStore(open_backend(ARGS.snapshot_backend)) if ARGS.save_season or ARGS.load_season else None
+    if ARGS.load_season:
+        # roll back instead of modding
+        with instrument.stage('restore'):
+            current = unpacked.buffers[MAIN_DB_NAME] if ARGS.in_memory else open(db_dir, 'rb').read()
+            try:
+                restored, conflicts = snapshots.restore(ARGS.load_season, season_v1, ARGS.save, ARGS.force,
+                                                        db_fingerprint(current))
+            except (KeyError, ValueError) as e:
+                # unknown snapshot name, or a save it wasn't taken from
+                season_v1.close_connection()
+                print(e.args[0])
+                raise SystemExit(1)
+        print(f"Restored {restored} values from snapshot {ARGS.load_season}, {conflicts} had changed since")
+    else:
+        # # calculate new values and assign them to the database
+        season_v1.run_modifiers(MODIFIERS)
+        season_v1.apply_plan(dry_run=ARGS.dry_run, detailed=bool(ARGS.save_season))
+        if ARGS.dry_run:
+            season_v1.close_connection()
+            print("Dry run, save left untouched")
+            raise SystemExit(0)
+    with instrument.stage('commit') as stage:
+        season_v1.commit(close=not ARGS.in_memory)
+    season_v1.timings['commit'] = stage['wall']
     print("Committed changes")
-    # # TODO: save season object to redis that can be later loaded if you need to roll back
-    print("Saved season object to redis")
+    for name, seconds in season_v1.timings.items():
+        print(f"{name:<24}{seconds * 1000:>10.2f} ms")
+
+    # the current save becomes <save>.bak1 once the new one is written, right before it's renamed over it
+    backup = SaveBackup(autosave_dir, cfg.save_backups)
+
     # #xAranaktu script to pack back to save
-    os_cmd = f'python "{script_dir}" --operation repack --result "{autosave_dir}" --input {result_dir}'
-    os.system(os_cmd)
-    print("Done repacking, have fun!")
\ No newline at end of file
+    instrument.detach()
+    verify = not ARGS.no_verify
+    try:
+        with instrument.stage('repack'):
+            if ARGS.in_memory:
+                main_db = serialize_memory_db(season_v1.conn, main_wal)
+                season_v1.close_connection()
+                if ARGS.debug:
+                    with open(db_dir, 'wb') as f:
+                        f.write(main_db)
+                dbs = [main_db, unpacked.buffers[BACKUP_DB_NAME], unpacked.buffers[BACKUP_DB2_NAME]]
+                repacked = process_repack_memory(unpacked.chunk1, dbs, autosave_dir, ARGS.compress_level, compress_workers,
+                                                 [backup], verify)
+            else:
+                repacked = process_repack(result_dir, autosave_dir, stream=True, chunk1=unpacked.chunk1,
+                                          level=ARGS.compress_level, workers=compress_workers, backups=unpacked.buffers or None,
+                                          before_replace=[backup], verify=verify)
+    except VerifyError as e:
+        # checked before the rename, the save on disk is still the one that was unpacked
+        print(f"The new save failed verification and was not written: {'; '.join(e.result.errors)}")
+        raise SystemExit(1)
+    instrument.add('repack', repacked.timings)
+    if backup.method:
+        print(f"Previous save kept as {backup_path(autosave_dir, 1)} ({backup.method})")
+    if repacked.verified is not None:
+        instrument.add('verify', repacked.verified.timings)
+        print(f"Save verified in {sum(repacked.verified.timings.values()) * 1000:.0f} ms")
+    if ARGS.save_season:
+        # stored once the save is written, fingerprinted with the main.db it now holds
+        written = main_db if ARGS.in_memory else open(db_dir, 'rb').read()
+        cells, size = snapshots.save(ARGS.save_season, season_v1.plan, ARGS.save, db_fingerprint(written))
+        print(f"Saved snapshot {ARGS.save_season}: {cells} changed values, {size} bytes")
+    print("Done repacking, have fun!", repacked)
+    if ARGS.report:
+        report = instrument.write(ARGS.report)
+        print(f"Run report written to {ARGS.report}, peak memory {(report['peak_rss'] or 0) / (1 << 20):.1f} MiB")
\ No newline at end of file
@@ -0,0 +1,102 @@
+import json
+
+from plan import Expr, Subquery
+
+# Parts_DesignStatValues columns the balance writes.
+COLUMNS = ('UnitValue', 'Value')
+
+# 'designs' applies to every design, 'powertrain' then overrides the engine/ERS/gearbox designs of the
+# engine manufacturers. Each group can override single stats under 'stats' (StatID -> columns).
+# 'handicaps' scales the values of a team's own designs (Parts_Designs.TeamID), e.g. {"3": 0.95}.
+DEFAULT_BALANCE = {
+    'designs': {'UnitValue': 25, 'Value': 250, 'stats': {}},
+    'powertrain': {'UnitValue': 100, 'Value': 1000, 'stats': {}},
+    'handicaps': {},
+}
+GROUPS = ('designs', 'powertrain')
+
+
+def validate_columns(values: dict, where: str) -> dict:
+    for column, value in values.items():
+        if column not in COLUMNS:
+            raise ValueError(f'{where}: unknown column "{column}", expected one of {", ".join(COLUMNS)}')
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f'{where}: {column} must be a number, got {value!r}')
+    return values
+
+
+def validate_balance(balance: dict, path: str) -> dict:
+    # -> {'designs': (columns, {stat_id: columns}), 'powertrain': (...), 'handicaps': {team_id: factor}}
+    if not isinstance(balance, dict):
+        raise ValueError(f'{path}: expected an object')
+    for key in balance:
+        if key not in (*GROUPS, 'handicaps'):
+            raise ValueError(f'{path}: unknown key "{key}"')
+
+    validated = dict()
+    for group in GROUPS:
+        entry = dict(balance.get(group, {}))
+        stats = entry.pop('stats', {}) or {}
+        base = validate_columns(entry, f'{path} {group}')
+        per_stat = {int(stat_id): validate_columns(values, f'{path} {group} stat {stat_id}') for stat_id, values in stats.items()}
+        validated[group] = (base, per_stat)
+
+    handicaps = dict()
+    for team_id, factor in (balance.get('handicaps') or {}).items():
+        if isinstance(factor, bool) or not isinstance(factor, (int, float)) or factor < 0:
+            raise ValueError(f'{path}: handicap of team {team_id} must be a positive number, got {factor!r}')
+        handicaps[int(team_id)] = factor
+    validated['handicaps'] = handicaps
+    return validated
+
+
+class PartsBalance:
+    design_stats: str = 'Parts_DesignStatValues'
+    designs_table: str = 'Parts_Designs'
+    engine_manufacturers: str = 'Parts_Enum_EngineManufacturers'
+
+    def __init__(self, balance: dict = None, path: str = 'balance'):
+        self.balance = validate_balance(DEFAULT_BALANCE if balance is None else balance, path)
+
+    @classmethod
+    def from_file(cls, path: str):
+        # the file only needs what it changes, every other value keeps DEFAULT_BALANCE
+        with open(path, 'r') as f:
+            balance = json.load(f)
+        if isinstance(balance, dict):
+            balance = {**DEFAULT_BALANCE, **{
+                key: {**DEFAULT_BALANCE[key], **value} if key in GROUPS and isinstance(value, dict) else value
+                for key, value in balance.items()
+            }}
+        return cls(balance, path)
+
+    def powertrain(self) -> Subquery:
+        # every engine, ERS and gearbox design id in one set
+        return Subquery(' UNION '.join(
+            f'SELECT {column} FROM {self.engine_manufacturers}' for column in ('EngineDesignID', 'ErsDesignID', 'GearboxDesignID')
+        ))
+
+    def team_designs(self, *team_ids: int) -> Subquery:
+        return Subquery(f"SELECT DesignID FROM {self.designs_table} WHERE TeamID IN ({', '.join(str(int(team_id)) for team_id in team_ids)})")
+
+    def compounds(self) -> bool:
+        # Handicaps scale the planned value, only designs without one (no designs values) get the save's own value
+        # scaled again on every run.
+        return bool(self.balance['handicaps']) and set(self.balance['designs'][0]) != set(COLUMNS)
+
+    def add_to_plan(self, plan):
+        # One set-based entry per group and per overridden stat, the handicaps scale whatever was planned before.
+        # The plan merges them into a single UPDATE of the stat values.
+        for group, where in (('designs', {}), ('powertrain', {'DesignID': self.powertrain()})):
+            base, per_stat = self.balance[group]
+            if base:
+                plan.update(self.design_stats, base, where=where or None)
+            for stat_id, values in per_stat.items():
+                plan.update(self.design_stats, values, where={**where, 'StatID': stat_id})
+
+        handicaps = self.balance['handicaps']
+        if handicaps:
+            # SET Value = Value * CASE WHEN DesignID IN (team 3's designs) THEN 0.95 ... END for every handicapped team
+            factor = ' '.join(f'WHEN DesignID IN ({self.team_designs(team_id)}) THEN ?' for team_id in handicaps)
+            scale = Expr(f'{{}} * CASE {factor} ELSE 1 END', *handicaps.values())
+            plan.update(self.design_stats, {column: scale for column in COLUMNS}, where={'DesignID': self.team_designs(*handicaps)})
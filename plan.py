@@ -0,0 +1,240 @@
+import json
+import sqlite3
+
+
+class Subquery(str):
+    # Marks a where value as SQL, e.g. {'DesignID': Subquery('SELECT EngineDesignID FROM ...')}
+    pass
+
+
+class Expr:
+    # A value computed by SQL, {} stands for the column's current (or previously planned) value,
+    # e.g. {'Value': Expr('{} * ?', 0.95)}
+    def __init__(self, sql: str, *params):
+        self.sql = sql
+        self.params = params
+
+    def bind(self, inner: str, inner_params=()) -> tuple:
+        # -> (sql, params) with every {} replaced by the inner expression
+        parts = self.sql.split('{}')
+        rest = list(self.params)
+        sql, params = '', list()
+        for i, part in enumerate(parts):
+            if i:
+                sql += f'({inner})'
+                params.extend(inner_params)
+            count = part.count('?')
+            sql += part
+            params.extend(rest[:count])
+            rest = rest[count:]
+        return sql, params
+
+
+def build_where(where: dict) -> tuple:
+    # -> (conditions joined by AND, params), '' when everything matches
+    clauses = list()
+    params = list()
+    for column, value in (where or {}).items():
+        if isinstance(value, Subquery):
+            clauses.append(f'{column} IN ({value})')
+        elif isinstance(value, (list, tuple, set)):
+            clauses.append(f'{column} IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(list(value)))
+        else:
+            clauses.append(f'{column} = ?')
+            params.append(value)
+    return ' AND '.join(clauses), params
+
+
+# Collects the writes of every modifier as set-based updates and keyed row updates. apply() merges the
+# entries into one statement per table: a column planned more than once becomes a single CASE over the
+# entries' where clauses, the last one that matches a row winning, so every cell is written at most once
+# and rows already holding their final value aren't written at all. Where clauses and Expr values see the
+# table as it was before the plan, except for {} which is the column's previously planned value.
+class ChangePlan:
+
+    def __init__(self):
+        self.entries = list()
+        self.changes = dict()
+        self.key_columns = dict()
+        self.stats = dict()
+
+    def update(self, table: str, values: dict, where: dict = None):
+        # Same effect as UPDATE table SET values WHERE where.
+        self.entries.append(('update', table, dict(values), where))
+
+    def update_rows(self, table: str, match_columns: tuple, columns: tuple, rows: list):
+        # Many rows addressed by their own match values, rows are (match values, new values).
+        self.entries.append(('rows', table, (tuple(match_columns), tuple(columns)), rows))
+
+    def mark(self) -> int:
+        return len(self.entries)
+
+    def truncate(self, mark: int):
+        # Drops everything planned after mark, used when a modifier fails half way.
+        del self.entries[mark:]
+
+    def table_key(self, db, table: str) -> list:
+        # rowid where there is one, the primary key for WITHOUT ROWID tables
+        if table not in self.key_columns:
+            try:
+                db.execute(f'SELECT rowid FROM {table} LIMIT 0;')
+                self.key_columns[table] = ['rowid']
+            except sqlite3.OperationalError:
+                info = db.execute(f'PRAGMA table_info({table});')
+                pk = sorted((row[5], row[1]) for row in info if row[5])
+                self.key_columns[table] = [name for _, name in pk]
+        return self.key_columns[table]
+
+    def groups(self, entries: list = None) -> list:
+        # Entries merged per table in planned order, an entry of another kind on the same table starts a new group.
+        groups = list()
+        latest = dict()
+        for kind, table, spec, arg in self.entries if entries is None else entries:
+            group = latest.get(table)
+            if group is None or group['kind'] != kind or (kind == 'rows' and group['spec'] != spec):
+                group = {'kind': kind, 'table': table, 'spec': spec, 'args': list()}
+                groups.append(group)
+                latest[table] = group
+            group['args'].append((spec, arg))
+        return groups
+
+    def build_update(self, table: str, args: list) -> tuple:
+        # -> (query, params), one UPDATE for every update entry of the group
+        values = dict()
+        filters = list()
+        unfiltered = False
+        for spec, where in args:
+            where_sql, where_params = build_where(where)
+            if where_sql:
+                filters.append((where_sql, where_params))
+            else:
+                unfiltered = True
+            for column, value in spec.items():
+                inner, inner_params = values.get(column, (column, []))
+                if isinstance(value, Expr):
+                    sql, params = value.bind(inner, inner_params)
+                else:
+                    sql, params = '?', [value]
+                if where_sql:
+                    sql, params = f'CASE WHEN {where_sql} THEN {sql} ELSE {inner} END', [*where_params, *params, *inner_params]
+                values[column] = (sql, params)
+
+        sets, changed, set_params = list(), list(), list()
+        for column, (sql, params) in values.items():
+            sets.append(f'{column} = {sql}')
+            changed.append(f'{column} IS NOT {sql}')
+            set_params.extend(params)
+        where_sql = ' OR '.join(f'({sql})' for sql, _ in filters)
+        where_params = [param for _, params in filters for param in params]
+        changed = ' OR '.join(changed)
+        where_sql = f' WHERE ({where_sql}) AND ({changed})' if not unfiltered else f' WHERE {changed}'
+        query = f"UPDATE {table} SET {', '.join(sets)}{where_sql};"
+        return query, [*set_params, *([] if unfiltered else where_params), *set_params]
+
+    def rows_query(self, table: str, key_columns: list, spec: tuple) -> str:
+        # reads the rows an update_rows group can match, narrowed down by its first match column
+        match_columns, columns = spec
+        return (f"SELECT {', '.join(key_columns + list(match_columns) + list(columns))} FROM {table} "
+                f"WHERE {match_columns[0]} IN (SELECT value FROM json_each(?));")
+
+    def apply_rows(self, db, table: str, spec: tuple, args: list):
+        # Matched in python after one read and written back by key, the match columns often have no index
+        # (one scan per row otherwise). A later row for the same match values replaces an earlier one.
+        match_columns, columns = spec
+        wanted = dict()
+        for _, rows in args:
+            wanted.update((tuple(match), tuple(new)) for match, new in rows)
+        key_columns = self.table_key(db, table)
+        nkey, nmatch = len(key_columns), len(match_columns)
+        params = list()
+        query = self.rows_query(table, key_columns, spec)
+        for row in db.execute_value(query, (json.dumps(list({match[0] for match in wanted})),)).fetchall():
+            new = wanted.get(tuple(row[nkey:nkey + nmatch]))
+            if new is not None and new != tuple(row[nkey + nmatch:]):
+                params.append((*new, *row[:nkey]))
+        sets = ', '.join(f'{column} = ?' for column in columns)
+        match = ' AND '.join(f'{name} = ?' for name in key_columns)
+        return db.execute_many(f'UPDATE {table} SET {sets} WHERE {match};', params)
+
+    def check(self, db, mark: int = 0):
+        # Compiles (EXPLAIN, nothing runs) every entry planned since mark on its own, so a missing table or
+        # column fails inside the modifier that planned it instead of when the merged plan is applied.
+        for group in self.groups(self.entries[mark:]):
+            for arg in group['args']:
+                if group['kind'] == 'update':
+                    query, params = self.build_update(group['table'], [arg])
+                else:
+                    query, params = self.rows_query(group['table'], self.table_key(db, group['table']), group['spec']), ['[]']
+                db.execute_value(f'EXPLAIN {query}', params)
+
+    def read_cells(self, db, groups: list) -> dict:
+        # -> {table: {key: {column: value}}} for every row the groups can touch
+        tables = dict()
+        for group in groups:
+            columns, filters = tables.setdefault(group['table'], (dict(), list()))
+            for spec, arg in group['args']:
+                if group['kind'] == 'update':
+                    columns.update(dict.fromkeys(spec))
+                    filters.append(build_where(arg))
+                else:
+                    match_columns, planned = spec
+                    columns.update(dict.fromkeys(planned))
+                    # narrowed down by the first match column, cells that don't change are dropped later anyway
+                    filters.append(build_where({match_columns[0]: list({match[0] for match, _ in arg})}))
+
+        cells = dict()
+        for table, (columns, filters) in tables.items():
+            key_columns = self.table_key(db, table)
+            columns = list(columns)
+            query = f"SELECT {', '.join(key_columns + columns)} FROM {table}"
+            params = list()
+            if all(sql for sql, _ in filters):
+                query += ' WHERE ' + ' OR '.join(f'({sql})' for sql, _ in filters)
+                params = [param for _, where_params in filters for param in where_params]
+            nkey = len(key_columns)
+            cells[table] = {
+                row[:nkey]: dict(zip(columns, row[nkey:]))
+                for row in db.execute_value(query + ';', params).fetchall()
+            }
+        return cells
+
+    def apply(self, db, record=False) -> int:
+        # record: keep the before/after value of every changed cell in self.changes, for the dry run diff and
+        # snapshots. Costs a read of the touched rows before and after, a dry run rolls the writes back itself.
+        groups = self.groups()
+        before = self.read_cells(db, groups) if record else None
+        writes = 0
+        for group in groups:
+            if group['kind'] == 'update':
+                query, params = self.build_update(group['table'], group['args'])
+                cursor = db.execute_value(query, params)
+            else:
+                cursor = self.apply_rows(db, group['table'], group['spec'], group['args'])
+            writes += max(cursor.rowcount, 0)
+        self.stats = {'entries': len(self.entries), 'statements': len(groups), 'writes': writes}
+
+        if record:
+            after = self.read_cells(db, groups)
+            self.changes = {
+                table: {
+                    (key, column): (values[column], after[table][key][column])
+                    for key, values in rows.items() for column in values
+                    if values[column] != after[table][key][column]
+                }
+                for table, rows in before.items()
+            }
+            self.stats['cells'] = sum(len(cells) for cells in self.changes.values())
+        return writes
+
+    def diff(self) -> list:
+        return [
+            (table, key, column, old, new)
+            for table, cells in self.changes.items()
+            for (key, column), (old, new) in cells.items()
+        ]
+
+    def print_diff(self):
+        for table, key, column, old, new in self.diff():
+            print(f"{table}[{', '.join(map(str, key))}].{column}: {old!r} -> {new!r}")
+        print(', '.join(f'{name} {count}' for name, count in self.stats.items()))
@@ -0,0 +1,96 @@
+import enum
+import json
+import os
+
+DEFAULT_RATINGS = os.path.join('drivers', 'F1_22.json')
+
+
+class DriverStats(enum.Enum):
+
+    Cornering = 2
+    Braking = 3
+    Control = 4
+
+    Smoothness = 5
+    Adaptability = 6
+    Overtaking = 7
+
+    Defence = 8
+    Acceleration = 9
+    Accuracy = 10
+
+
+# json key -> StatID, e.g. 'cornering' -> 2
+STAT_IDS = {stat.name.lower(): stat.value for stat in DriverStats}
+# keys in a ratings entry that are not stats
+INFO_KEYS = ('driver', 'ID')
+
+
+def driver_code(_id: str) -> str:
+    # 'HAM' -> '[DriverCode_Ham]' as stored in Staff_DriverData.DriverCode
+    return f'[DriverCode_{_id.lower().capitalize()}]'
+
+
+def validate_entry(entry: dict, path: str) -> dict:
+    if not isinstance(entry, dict) or not isinstance(entry.get('ID'), str):
+        raise ValueError(f'{path}: every driver needs a string "ID", got {entry!r}')
+
+    stats = dict()
+    for key, value in entry.items():
+        if key in INFO_KEYS:
+            continue
+        if key not in STAT_IDS:
+            raise ValueError(f'{path}: {entry["ID"]} has unknown stat "{key}"')
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= 100:
+            raise ValueError(f'{path}: {entry["ID"]} {key} must be a number between 0 and 100, got {value!r}')
+        stats[STAT_IDS[key]] = value
+    return stats
+
+
+class DriverRatings:
+    drivers_table: str = 'Staff_DriverData'
+    drivers_stats: str = 'Staff_PerformanceStats'
+
+    def __init__(self, paths: list = None):
+        # Files are merged in order, a later file overrides the stats it lists from earlier ones.
+        self.paths = paths or [DEFAULT_RATINGS]
+        self.table = dict()
+        for path in self.paths:
+            self.merge(path)
+
+    def merge(self, path: str):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if not isinstance(data, list):
+            raise ValueError(f'{path}: expected a list of drivers')
+
+        size = max(STAT_IDS.values()) + 1
+        for entry in data:
+            stats = validate_entry(entry, path)
+            # stat_id indexed row, None where no file rated that stat
+            row = self.table.setdefault(driver_code(entry['ID']), [None] * size)
+            for stat_id, value in stats.items():
+                row[stat_id] = value
+
+    def resolve(self, db):
+        # All DriverCodes -> StaffIDs in one query, returns the mapping and the codes the save doesn't know.
+        codes = list(self.table)
+        if not codes:
+            return dict(), list()
+        query = f"SELECT DriverCode, StaffID FROM {self.drivers_table} WHERE DriverCode IN ({', '.join('?' * len(codes))});"
+        staff_ids = dict(db.execute_value(query, codes).fetchall())
+        unknown = [code for code in codes if code not in staff_ids]
+        return staff_ids, unknown
+
+    def rows(self, staff_ids: dict) -> list:
+        return [
+            (value, staff_ids[code], stat_id)
+            for code, row in self.table.items() if code in staff_ids
+            for stat_id, value in enumerate(row) if value is not None
+        ]
+
+    def add_to_plan(self, db, plan):
+        staff_ids, unknown = self.resolve(db)
+        rows = [((staff_id, stat_id), (value,)) for value, staff_id, stat_id in self.rows(staff_ids)]
+        plan.update_rows(self.drivers_stats, ('StaffID', 'StatID'), ('Val',), rows)
+        return staff_ids, unknown
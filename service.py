@@ -0,0 +1,320 @@
+import argparse
+import contextlib
+import json
+import os
+import queue
+import shutil
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import config as cfg
+from ratings import DriverStats
+from utils.dbcache import DBCache, CACHE_DIR
+from utils.savefile import ExpectUnchanged, SaveBackup, SaveChanged, signature
+from utils.script import process_unpack, process_repack_memory, MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME
+
+# Every pooled connection shares the unpacked main.db file. No exclusive locking (unlike the scratch profile)
+# so readers and the single writer can take turns, a reader waits out a commit through busy_timeout.
+POOL_PRAGMAS = (
+    'PRAGMA synchronous = OFF;',
+    'PRAGMA cache_size = -16384;',
+    'PRAGMA temp_store = MEMORY;',
+    'PRAGMA busy_timeout = 5000;',
+)
+POOL_SIZE = 4
+
+# table -> key columns, every other column of these tables can be edited one field at a time
+EDITABLE = {
+    'Staff_DriverData': ('StaffID',),
+    'Staff_PerformanceStats': ('StaffID', 'StatID'),
+    'Tyres': ('Type',),
+    'Races_TeamPerformance': ('TeamID', 'TrackID'),
+    'Finance_TeamBalance': ('TeamID',),
+    'Parts_DesignStatValues': ('DesignID', 'StatID'),
+}
+
+# read endpoints -> table, the query string filters on key columns
+READS = {
+    'tyres': 'Tyres',
+    'team_performance': 'Races_TeamPerformance',
+    'finances': 'Finance_TeamBalance',
+    'design_stats': 'Parts_DesignStatValues',
+}
+
+PORT = 8022
+
+
+class NotFound(LookupError):
+    pass
+
+
+class ConnectionPool:
+
+    def __init__(self, db_path, size=POOL_SIZE, pragmas=POOL_PRAGMAS):
+        self.connections = queue.Queue()
+        for _ in range(size):
+            # handed between the server threads, never used by two at once
+            conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            for pragma in pragmas:
+                conn.execute(pragma)
+            self.connections.put(conn)
+        self.size = size
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.connections.get()
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+    def close(self):
+        for _ in range(self.size):
+            self.connections.get().close()
+
+
+class EditSession:
+    # One save unpacked once: main.db on disk behind a connection pool, the backups in memory.
+    # Edits are committed to main.db straight away, publish() repacks the save in a background thread.
+
+    def __init__(self, save_path, pool_size=POOL_SIZE, cache=None, level=-1, compress_workers=1, keep_backups=0):
+        self.save_path = save_path
+        self.level = level
+        self.compress_workers = compress_workers
+        self.keep_backups = keep_backups
+        self.work_dir = tempfile.mkdtemp(prefix='f1edit-')
+        # the save as it was unpacked (then as last published), a publish only replaces it while it still matches
+        self.signature = signature(save_path)
+        self.unpacked = process_unpack(save_path, self.work_dir, stream=True, cache=cache, selective=True)
+        self.db_path = os.path.join(self.work_dir, MAIN_DB_NAME)
+        self.pool = ConnectionPool(self.db_path, pool_size)
+        # one writer at a time, publish also holds it while it copies main.db
+        self.write_lock = threading.Lock()
+        self.publisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='publish')
+        self.publishes = list()
+        self.edits = 0
+        self.unpublished = 0
+        with self.pool.connection() as conn:
+            self.wal = conn.execute('PRAGMA journal_mode;').fetchone()[0] == 'wal'
+            self.columns = {table: [row['name'] for row in conn.execute(f'PRAGMA table_info({table});')] for table in EDITABLE}
+
+    def rows(self, table, filters=None):
+        if table not in EDITABLE:
+            raise ValueError(f'unknown table "{table}"')
+        where = dict(filters or {})
+        for column in where:
+            if column not in EDITABLE[table]:
+                raise ValueError(f'{table} can only be filtered on {", ".join(EDITABLE[table])}')
+        clause = ' AND '.join(f'{column} = ?' for column in where)
+        query = f'SELECT * FROM {table}' + (f' WHERE {clause}' if clause else '') + ';'
+        with self.pool.connection() as conn:
+            return [dict(row) for row in conn.execute(query, list(where.values()))]
+
+    def drivers(self):
+        # driver code and stats by name, e.g. {'StaffID': 1, 'DriverCode': ..., 'cornering': 88, ...}
+        names = {stat.value: stat.name.lower() for stat in DriverStats}
+        query = '''
+            SELECT d.StaffID, d.DriverCode, d.Improvability, d.Aggression, s.StatID, s.Val
+            FROM Staff_DriverData d JOIN Staff_PerformanceStats s ON s.StaffID = d.StaffID
+            ORDER BY d.StaffID, s.StatID;
+        '''
+        drivers = dict()
+        with self.pool.connection() as conn:
+            for row in conn.execute(query):
+                driver = drivers.setdefault(row['StaffID'], {key: row[key] for key in ('StaffID', 'DriverCode', 'Improvability', 'Aggression')})
+                if row['StatID'] in names:
+                    driver[names[row['StatID']]] = row['Val']
+        return list(drivers.values())
+
+    def edit(self, table, key, column, value):
+        # Sets one field of one row -> {'before': ..., 'after': ...}
+        if table not in EDITABLE:
+            raise ValueError(f'unknown table "{table}"')
+        key_columns = EDITABLE[table]
+        if set(key) != set(key_columns):
+            raise ValueError(f'{table} rows are identified by {", ".join(key_columns)}')
+        if column in key_columns or column not in self.columns[table]:
+            raise ValueError(f'{table} has no editable column "{column}"')
+        if isinstance(value, (dict, list)):
+            raise ValueError(f'{table}.{column} takes a single value')
+
+        clause = ' AND '.join(f'{name} = ?' for name in key_columns)
+        params = [key[name] for name in key_columns]
+        with self.write_lock, self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE;')
+            try:
+                found = conn.execute(f'SELECT {column} FROM {table} WHERE {clause};', params).fetchall()
+                if len(found) != 1:
+                    raise ValueError(f'{table} has {len(found)} rows for {key}, expected 1')
+                conn.execute(f'UPDATE {table} SET {column} = ? WHERE {clause};', [value, *params])
+                conn.execute('COMMIT;')
+            except BaseException:
+                conn.execute('ROLLBACK;')
+                raise
+            self.edits += 1
+            self.unpublished += 1
+        return {'before': found[0][0], 'after': value}
+
+    def snapshot_main_db(self):
+        # main.db as committed so far, taken under the write lock so no edit lands halfway
+        with self.write_lock:
+            if self.wal:
+                with self.pool.connection() as conn:
+                    conn.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+            with open(self.db_path, 'rb') as f:
+                data = f.read()
+            edits, self.unpublished = self.unpublished, 0
+        return data, edits
+
+    def publish(self):
+        # Queues a repack of the current state over the save, returns its entry in self.publishes.
+        main_db, edits = self.snapshot_main_db()
+        job = {'id': len(self.publishes) + 1, 'state': 'queued', 'edits': edits, 'queued': time.time()}
+        self.publishes.append(job)
+        job['future'] = self.publisher.submit(self.repack, job, main_db)
+        return job
+
+    def repack(self, job, main_db):
+        job['state'] = 'running'
+        _t = time.perf_counter()
+        try:
+            dbs = [main_db, self.unpacked.buffers[BACKUP_DB_NAME], self.unpacked.buffers[BACKUP_DB2_NAME]]
+            # verified before it replaces the save, a failing one raises VerifyError and is never installed
+            before_replace = [ExpectUnchanged(self.save_path, self.signature), SaveBackup(self.save_path, self.keep_backups)]
+            repacked = process_repack_memory(self.unpacked.chunk1, dbs, self.save_path, self.level, self.compress_workers,
+                                             before_replace, verify=True)
+            self.signature = signature(self.save_path)
+            job.update(state='done', zlib_size=repacked.zlib_size)
+        except SaveChanged as e:
+            # the game (or something else) wrote the save since it was unpacked, its version is kept
+            job.update(state='conflict', error=f'{e}, reopen the save to edit the new version')
+        except Exception as e:
+            job.update(state='failed', error=f'{type(e).__name__}: {e}')
+        job['seconds'] = time.perf_counter() - _t
+        return job
+
+    def status(self):
+        return {
+            'save': self.save_path,
+            'edits': self.edits,
+            'unpublished': self.unpublished,
+            'publishes': [{key: value for key, value in job.items() if key != 'future'} for job in self.publishes],
+        }
+
+    def close(self):
+        # waits for queued publishes
+        self.publisher.shutdown(wait=True)
+        self.pool.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class Handler(BaseHTTPRequestHandler):
+    # GET  /drivers /tyres /team_performance /finances /design_stats (?Key=value filters) /status
+    # POST /edit {"table": ..., "key": {...}, "column": ..., "value": ...}   POST /publish
+    session: EditSession = None
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self, route):
+        _t = time.perf_counter()
+        try:
+            body = route()
+        except NotFound:
+            return self.reply(404, {'error': f'no route {self.command} {self.path}'})
+        except KeyError as e:
+            return self.reply(400, {'error': f'missing {e}'})
+        except (ValueError, TypeError, sqlite3.Error) as e:
+            return self.reply(400, {'error': str(e)})
+        if isinstance(body, dict):
+            body['ms'] = (time.perf_counter() - _t) * 1000
+        self.reply(200, body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        name = url.path.strip('/')
+        filters = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        def route():
+            if name == 'drivers':
+                return self.session.drivers()
+            if name == 'status':
+                return self.session.status()
+            if name not in READS:
+                raise NotFound(name)
+            return self.session.rows(READS[name], filters)
+        self.handle_request(route)
+
+    def do_POST(self):
+        name = urlparse(self.path).path.strip('/')
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length)
+
+        def route():
+            payload = json.loads(data or b'{}')
+            if name == 'edit':
+                return self.session.edit(payload['table'], payload['key'], payload['column'], payload['value'])
+            if name == 'publish':
+                job = self.session.publish()
+                if payload.get('wait'):
+                    job['future'].result()
+                return {key: value for key, value in job.items() if key != 'future'}
+            raise NotFound(name)
+        self.handle_request(route)
+
+    def log_message(self, format, *args):
+        pass  # keep the console for the session messages
+
+
+def stop(_signum, _frame):
+    # stopped as a service: unwind the same way as Ctrl+C so the session still cleans up
+    raise KeyboardInterrupt
+
+
+def serve(session, host='127.0.0.1', port=PORT):
+    Handler.session = session
+    server = ThreadingHTTPServer((host, port), Handler)
+    signal.signal(signal.SIGTERM, stop)
+    print(f"Editing {session.save_path} on http://{host}:{server.server_address[1]}, Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return server
+
+
+if __name__ == '__main__':
+    # python service.py --save autosave.sav --port 8022
+    parser = argparse.ArgumentParser(description='Local JSON API for editing an unpacked save')
+    parser.add_argument('--save', type=str, default='autosave.sav', help='the name of the save to edit and publish to')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=PORT, help='port to listen on')
+    parser.add_argument('--pool_size', type=int, default=POOL_SIZE, help='sqlite connections kept open on main.db')
+    parser.add_argument('--db_cache', action='store_true', help='reuse databases cached from an identical save instead of inflating it')
+    parser.add_argument('--compress_level', type=int, default=-1, help='zlib level used when publishing')
+    parser.add_argument('--compress_workers', type=int, default=1, help='deflate threads used when publishing, 0 for every core')
+    ARGS = parser.parse_args()
+
+    db_cache = DBCache(cfg.db_cache_folder or CACHE_DIR, cfg.db_cache_size_mb << 20) if ARGS.db_cache else None
+    session = EditSession(os.path.join(cfg.save_folder, ARGS.save), ARGS.pool_size, db_cache, ARGS.compress_level,
+                          ARGS.compress_workers or os.cpu_count(), cfg.save_backups)
+    try:
+        serve(session, ARGS.host, ARGS.port)
+    finally:
+        if session.unpublished:
+            print(f"{session.unpublished} edits were not published")
+        session.close()
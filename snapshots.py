@@ -0,0 +1,143 @@
+import base64
+import hashlib
+import json
+import os
+import time
+import zlib
+
+import config as cfg
+
+
+def encode_value(value):
+    # json can't hold BLOB cells
+    if isinstance(value, bytes):
+        return {'$b': base64.b64encode(value).decode()}
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict):
+        return base64.b64decode(value['$b'])
+    return value
+
+
+class FileBackend:
+    # Snapshots as <name>.snap files in a folder, no server needed.
+    extension: str = '.snap'
+
+    def __init__(self, folder, keep=10):
+        self.folder = folder
+        self.keep = keep
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def path(self, name):
+        return os.path.join(self.folder, name + self.extension)
+
+    def put(self, name, blob):
+        tmp_path = self.path(name) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp_path, self.path(name))
+        self.evict()
+
+    def get(self, name):
+        if not os.path.exists(self.path(name)):
+            return None
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    def names(self):
+        # newest first
+        files = [f for f in os.listdir(self.folder) if f.endswith(self.extension)]
+        files.sort(key=lambda f: os.path.getmtime(os.path.join(self.folder, f)), reverse=True)
+        return [f[:-len(self.extension)] for f in files]
+
+    def evict(self):
+        for name in self.names()[self.keep:]:
+            os.remove(self.path(name))
+
+
+def db_fingerprint(data) -> str:
+    # main.db exactly as the run wrote it, the game rewrites it on every save
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def open_backend(kind=None, f1_cfg=cfg):
+    kind = kind or f1_cfg.snapshot_backend
+    if kind == 'redis':
+        # only needs the redis package when actually used
+        from conredis import ConRedis
+        return ConRedis(host=f1_cfg.redis_host, port=f1_cfg.redis_port, keep=f1_cfg.snapshot_keep)
+    folder = f1_cfg.snapshot_folder or os.path.join(f1_cfg.save_folder, 'snapshots')
+    return FileBackend(folder, keep=f1_cfg.snapshot_keep)
+
+
+class SnapshotStore:
+    # Rollback points holding only the cells a run changed, as before/after pairs.
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def save(self, name, plan, save_name=None, fingerprint=None):
+        # fingerprint: db_fingerprint of the main.db the run wrote into the save
+        snapshot = {
+            'save': save_name,
+            'fingerprint': fingerprint,
+            'created': time.time(),
+            'keys': {table: plan.key_columns[table] for table in plan.changes},
+            'cells': [
+                [table, list(key), column, encode_value(old), encode_value(new)]
+                for table, key, column, old, new in plan.diff()
+            ],
+        }
+        blob = zlib.compress(json.dumps(snapshot, separators=(',', ':')).encode(), 9)
+        self.backend.put(name, blob)
+        return len(snapshot['cells']), len(blob)
+
+    def load(self, name):
+        blob = self.backend.get(name)
+        if blob is None:
+            raise KeyError(f"No snapshot named {name}")
+        snapshot = json.loads(zlib.decompress(blob))
+        snapshot['cells'] = [
+            (table, tuple(key), column, decode_value(old), decode_value(new))
+            for table, key, column, old, new in snapshot['cells']
+        ]
+        return snapshot
+
+    def names(self):
+        return self.backend.names()
+
+    def restore(self, name, db, save_name=None, force=False, fingerprint=None):
+        # Applies the reverse delta: every recorded cell goes back to its value from before the run.
+        # Cells are addressed by rowid, so the snapshot only fits the save it was taken from, as that run wrote it
+        # (fingerprint: db_fingerprint of the main.db being restored into).
+        snapshot = self.load(name)
+        taken_from = snapshot.get('save')
+        if not force and save_name is not None and taken_from is not None \
+                and os.path.basename(taken_from) != os.path.basename(save_name):
+            raise ValueError(f"Snapshot {name} was taken from {taken_from}, not {save_name}, use --force to restore it anyway")
+        expected = snapshot.get('fingerprint')
+        if not force and fingerprint is not None and expected is not None and fingerprint != expected:
+            raise ValueError(f"{save_name or 'The save'} is no longer the one snapshot {name} was taken from (the game saved "
+                             f"again, or it holds another career), use --force to restore it anyway")
+        grouped = dict()
+        for table, key, column, old, new in snapshot['cells']:
+            grouped.setdefault((table, column), list()).append((key, old, new))
+
+        conflicts = 0
+        for (table, column), cells in grouped.items():
+            key_columns = snapshot['keys'][table]
+            match = ' AND '.join(f'{key_column} = ?' for key_column in key_columns)
+            if key_columns == ['rowid']:
+                query = f'SELECT rowid, {column} FROM {table} WHERE rowid IN (SELECT value FROM json_each(?));'
+                rows = db.execute_value(query, (json.dumps([key[0] for key, _, _ in cells]),)).fetchall()
+                current = {(rowid,): value for rowid, value in rows}
+            else:
+                query = f'SELECT {column} FROM {table} WHERE {match};'
+                current = {key: row[0] for key, _, _ in cells for row in db.execute_value(query, key).fetchall()}
+            # with --force, cells changed since the snapshot (e.g. the game played on) are restored anyway, only counted
+            conflicts += sum(1 for key, _, new in cells if key not in current or current[key] != new)
+            db.execute_many(f'UPDATE {table} SET {column} = ? WHERE {match};', [(old, *key) for key, old, _ in cells])
+        return len(snapshot['cells']), conflicts
@@ -0,0 +1,170 @@
+import json
+import statistics
+from array import array
+
+from ratings import STAT_IDS
+
+# Procedural ratings for the whole staff pool: every stat of a table is read in one query, each rule
+# is applied to the value columns as a whole and the result is planned as one bulk update_rows write.
+# JSON driver ratings (set_driver_data) run after this and override the drivers they list.
+
+# rules file key -> stats table
+TABLES = {
+    'drivers': 'Staff_PerformanceStats',
+    'pit_crew': 'Staff_PitCrew_PerformanceStats',
+}
+RULES = ('rescale', 'compress', 'cap')
+# every stat stays in the game's 0..100 range and is stored as a whole number like the JSON ratings
+STAT_RANGE = (0, 100)
+
+
+def stat_id(stat, where):
+    # 'cornering' or 2
+    if isinstance(stat, str) and stat.lower() in STAT_IDS:
+        return STAT_IDS[stat.lower()]
+    if isinstance(stat, int) and not isinstance(stat, bool):
+        return stat
+    raise ValueError(f'{where}: unknown stat {stat!r}')
+
+
+def number(rule, key, where, minimum=None):
+    value = rule.get(key)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (minimum is not None and value < minimum):
+        raise ValueError(f'{where}: "{key}" must be a number' + ('' if minimum is None else f' of at least {minimum}') + f', got {value!r}')
+    return value
+
+
+def validate_rule(rule, where):
+    if not isinstance(rule, dict) or rule.get('rule') not in RULES:
+        raise ValueError(f'{where}: every rule needs "rule" set to one of {", ".join(RULES)}, got {rule!r}')
+    validated = {
+        'rule': rule['rule'],
+        'stats': None if rule.get('stats') is None else [stat_id(stat, where) for stat in rule['stats']],
+        # any query returning StaffIDs, e.g. an age or tier condition on the save's staff tables
+        'staff': rule.get('staff'),
+    }
+    if validated['staff'] is not None and not isinstance(validated['staff'], str):
+        raise ValueError(f'{where}: "staff" must be a query returning StaffIDs')
+    if rule['rule'] == 'rescale':
+        validated.update(mean=number(rule, 'mean', where), std=number(rule, 'std', where, 0))
+    elif rule['rule'] == 'compress':
+        validated.update(factor=number(rule, 'factor', where, 0),
+                         center=None if rule.get('center') is None else number(rule, 'center', where))
+    else:
+        if rule.get('min') is None and rule.get('max') is None:
+            raise ValueError(f'{where}: cap needs "min", "max" or both')
+        validated.update(min=None if rule.get('min') is None else number(rule, 'min', where),
+                         max=None if rule.get('max') is None else number(rule, 'max', where))
+    return validated
+
+
+def ranks(values):
+    # fractional rank of every value in 0..1, ties share their average rank
+    order = sorted(range(len(values)), key=values.__getitem__)
+    result = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        rank = ((i + j) / 2 + 0.5) / len(values)
+        for k in range(i, j + 1):
+            result[order[k]] = rank
+        i = j + 1
+    return result
+
+
+def rescale(values, mean, std):
+    # maps the current order onto a normal distribution, the best stays the best
+    if not values:
+        return values
+    if std == 0:
+        return [mean] * len(values)
+    dist = statistics.NormalDist(mean, std)
+    return [dist.inv_cdf(rank) for rank in ranks(values)]
+
+
+def compress(values, factor, center=None):
+    # pulls every value towards center (the current mean by default), factor 0.5 halves the spread
+    if not values:
+        return values
+    center = statistics.fmean(values) if center is None else center
+    return [center + (value - center) * factor for value in values]
+
+
+def cap(values, low=None, high=None):
+    low = -float('inf') if low is None else low
+    high = float('inf') if high is None else high
+    return [min(max(value, low), high) for value in values]
+
+
+class StaffRatings:
+    # {"drivers": [rules], "pit_crew": [rules]}, rules run in order, e.g.
+    # {"rule": "rescale", "mean": 75, "std": 8, "stats": ["cornering"]}
+    # {"rule": "compress", "factor": 0.5}
+    # {"rule": "cap", "max": 80, "staff": "SELECT StaffID FROM ..."}
+
+    def __init__(self, rules: dict = None, path: str = 'rules'):
+        self.path = path
+        self.rules = dict()
+        if not isinstance(rules or {}, dict):
+            raise ValueError(f'{path}: expected an object')
+        for key, table_rules in (rules or {}).items():
+            if key not in TABLES:
+                raise ValueError(f'{path}: unknown key "{key}", expected one of {", ".join(TABLES)}')
+            if not isinstance(table_rules, list):
+                raise ValueError(f'{path}: {key} must be a list of rules')
+            self.rules[TABLES[key]] = [validate_rule(rule, f'{path} {key} rule {i}') for i, rule in enumerate(table_rules)]
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path, 'r') as f:
+            return cls(json.load(f), path)
+
+    def read(self, db, table):
+        # -> {stat_id: (staff ids, values)} for every stat of the table, grouped by sqlite in one query
+        query = f'SELECT StatID, json_group_array(StaffID), json_group_array(Val) FROM {table} WHERE Val IS NOT NULL GROUP BY StatID;'
+        return {
+            stat: (array('q', json.loads(staff_ids)), array('d', json.loads(values)))
+            for stat, staff_ids, values in db.execute_value(query, ()).fetchall()
+        }
+
+    def generate(self, db, table):
+        # -> [((StaffID, StatID), (Val,))] for the values the rules changed
+        columns = self.read(db, table)
+        selections = dict()
+        generated = {stat: list(values) for stat, (_, values) in columns.items()}
+        for rule in self.rules[table]:
+            if rule['staff'] is not None and rule['staff'] not in selections:
+                selections[rule['staff']] = {row[0] for row in db.execute_value(f"SELECT * FROM ({rule['staff']});", ()).fetchall()}
+            selected = selections.get(rule['staff'])
+            for stat in (generated if rule['stats'] is None else rule['stats']):
+                if stat not in generated:
+                    continue
+                staff_ids, values = columns[stat][0], generated[stat]
+                index = range(len(values)) if selected is None else [i for i, staff_id in enumerate(staff_ids) if staff_id in selected]
+                subset = [values[i] for i in index]
+                if rule['rule'] == 'rescale':
+                    subset = rescale(subset, rule['mean'], rule['std'])
+                elif rule['rule'] == 'compress':
+                    subset = compress(subset, rule['factor'], rule['center'])
+                else:
+                    subset = cap(subset, rule['min'], rule['max'])
+                for i, value in zip(index, subset):
+                    values[i] = value
+
+        rows = list()
+        low, high = STAT_RANGE
+        for stat, (staff_ids, before) in columns.items():
+            after = [round(value) for value in cap(generated[stat], low, high)]
+            rows.extend(((staff_id, stat), (new,)) for staff_id, old, new in zip(staff_ids, before, after) if new != old)
+        return rows
+
+    def add_to_plan(self, db, plan):
+        # -> {table: rows planned}
+        planned = dict()
+        for table in self.rules:
+            rows = self.generate(db, table)
+            plan.update_rows(table, ('StaffID', 'StatID'), ('Val',), rows)
+            planned[table] = len(rows)
+        return planned
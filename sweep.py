@@ -0,0 +1,137 @@
+import argparse
+import contextlib
+import copy
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import config as cfg
+from main import SeasonChanger, MODIFIERS, add_season_args, season_kwargs_from_args, load_memory_db, serialize_memory_db
+from utils.script import process_unpack_memory, process_repack_memory, MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME
+
+# decompressed base save, set once per worker process
+_BASE = None
+
+
+def parse_grid(specs):
+    # ['tperf_diff=0.3,0.4', 'drs=1.05'] -> {'tperf_diff': [0.3, 0.4], 'drs': [1.05]}
+    grid = dict()
+    for spec in specs:
+        name, sep, values = spec.partition('=')
+        if not sep or not values:
+            raise ValueError(f'grid entries look like name=value,value,... got {spec!r}')
+        grid[name.strip().lstrip('-')] = [json.loads(value) for value in values.split(',')]
+    return grid
+
+
+def expand_grid(base_args, grid):
+    # One argparse namespace per grid point, in itertools.product order.
+    for name in grid:
+        if not hasattr(base_args, name):
+            raise ValueError(f'{name} is not a season argument')
+    names = list(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        args = copy.copy(base_args)
+        for name, value in zip(names, values):
+            setattr(args, name, value)
+        yield dict(zip(names, values)), args
+
+
+def init_worker(chunk1, buffers):
+    global _BASE
+    _BASE = (chunk1, buffers)
+
+
+def run_variant(output_path, season_kwargs, modifiers=MODIFIERS, profile='scratch', level=-1, compress_workers=1, verify=True):
+    # main.db is cloned from the worker's copy of the base, the backups are reused untouched
+    chunk1, buffers = _BASE
+    timings = dict()
+    _t = time.perf_counter()
+    conn, wal = load_memory_db(buffers[MAIN_DB_NAME])
+    timings['clone'] = time.perf_counter() - _t
+
+    _t = time.perf_counter()
+    season = SeasonChanger(db_path=MAIN_DB_NAME, conn=conn, profile=profile, **season_kwargs)
+    # every variant prints the same progress lines, keep the sweep output readable
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        season.run_modifiers(modifiers)
+        season.apply_plan()
+    season.commit(close=False)
+    main_db = serialize_memory_db(season.conn, wal)
+    season.close_connection()
+    timings['modify'] = time.perf_counter() - _t
+
+    _t = time.perf_counter()
+    dbs = [main_db, buffers[BACKUP_DB_NAME], buffers[BACKUP_DB2_NAME]]
+    repacked = process_repack_memory(chunk1, dbs, output_path, level, compress_workers, verify=verify)
+    timings['repack'] = time.perf_counter() - _t
+    if repacked.verified is not None:
+        # checked inside the repack, before the rename, reported on its own
+        timings['verify'] = sum(repacked.verified.timings.values())
+        timings['repack'] -= timings['verify']
+    return {'writes': season.plan.stats.get('writes', 0), 'zlib_size': repacked.zlib_size, 'timings': timings}
+
+
+def run_sweep(base_save, base_args, grid, output_dir, jobs=None, **options):
+    os.makedirs(output_dir, exist_ok=True)
+    _t = time.perf_counter()
+    unpacked = process_unpack_memory(base_save)
+    unpack_time = time.perf_counter() - _t
+    # plain bytes pickle once per worker, the buffers themselves are bytearrays
+    buffers = {name: bytes(buffer) for name, buffer in unpacked.buffers.items()}
+
+    stem = os.path.splitext(os.path.basename(base_save))[0]
+    variants = [
+        {'file': os.path.join(output_dir, f'{stem}-{i:03d}.sav'), 'params': params, 'season_kwargs': season_kwargs_from_args(args)}
+        for i, (params, args) in enumerate(expand_grid(base_args, grid))
+    ]
+
+    _t = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count(), initializer=init_worker,
+                             initargs=(unpacked.chunk1, buffers)) as pool:
+        futures = [pool.submit(run_variant, variant['file'], variant['season_kwargs'], **options) for variant in variants]
+        results = [future.result() for future in futures]
+
+    manifest = {
+        'base': os.path.abspath(base_save),
+        'defaults': {name: value for name, value in vars(base_args).items() if name not in ('grid', 'output', 'jobs', 'save')},
+        'grid': grid,
+        'unpack': unpack_time,
+        'wall': time.perf_counter() - _t,
+        'variants': [
+            {'file': os.path.basename(variant['file']), 'params': variant['params'], **result}
+            for variant, result in zip(variants, results)
+        ],
+    }
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == '__main__':
+    # python sweep.py --grid tperf_diff=0.3,0.4,0.5 --grid dirty_air=0.2,0.3 --output sweep
+    parser = argparse.ArgumentParser(description='Write one modded save per point of a parameter grid')
+    parser.add_argument('--save', type=str, default='autosave.sav', help='base save, relative names are looked up in the save folder')
+    parser.add_argument('--grid', type=str, action='append', required=True, help='name=value,value,... for any season argument, repeat for more axes')
+    parser.add_argument('--output', type=str, default=None, help='folder for the variant saves and manifest.json, defaults to <save folder>/sweep')
+    parser.add_argument('--jobs', type=int, default=0, help='variants processed at once, 0 for every core')
+    parser.add_argument('--no_verify', action='store_true', help='skip re-reading every variant save to check it')
+    add_season_args(parser)
+    ARGS = parser.parse_args()
+
+    base_save = ARGS.save if os.path.exists(ARGS.save) else os.path.join(cfg.save_folder, ARGS.save)
+    output_dir = ARGS.output or os.path.join(cfg.save_folder, 'sweep')
+    # 0 means every core here too, shared by the variants running at once
+    jobs = ARGS.jobs or os.cpu_count()
+    compress_workers = ARGS.compress_workers or max(1, os.cpu_count() // jobs)
+    manifest = run_sweep(base_save, ARGS, parse_grid(ARGS.grid), output_dir, jobs=jobs,
+                         profile=ARGS.db_profile, level=ARGS.compress_level, compress_workers=compress_workers,
+                         verify=not ARGS.no_verify)
+
+    for variant in manifest['variants']:
+        stages = '  '.join(f'{stage} {seconds * 1000:.0f}ms' for stage, seconds in variant['timings'].items())
+        print(f"{variant['file']:<24}{json.dumps(variant['params']):<48}{variant['writes']:>8} writes  {stages}")
+    print(f"{len(manifest['variants'])} variants in {manifest['wall']:.2f}s after a {manifest['unpack'] * 1000:.0f}ms unpack, "
+          f"manifest in {os.path.join(output_dir, 'manifest.json')}")
@@ -0,0 +1,88 @@
+import json
+
+from plan import Expr
+
+# Tyre compounds the game stores as Tyres.Type 0..4.
+COMPOUNDS = 5
+
+# Per-compound step for the temperature/wear columns, compound i gets base + i / step.
+TEMPSWEAR_STEPS = {
+    'TempIncRate': 20,
+    'TempDecRate': 25,
+    'MinExtremeWear': 30,
+    'MaxExtremeWear': 100,
+    'MinOptimalWear': 30,
+    'MaxOptimalWear': 100,
+    'MinOptimalGrip': 7.5,
+    'MaxOptimalGrip': 10,
+    'MinExtremeGrip': 20,
+    'MaxExtremeGrip': 15,
+}
+
+
+class TyreModel:
+    tyres_table: str = 'Tyres'
+
+    def __init__(self, base_tyre_life: float, base_perf: float, tyre3set_life_diff: float, tyre3set_perf_diff: float,
+                 base_params: dict, steps: dict = None, compounds: int = COMPOUNDS):
+        self.base_tyre_life = base_tyre_life
+        self.base_perf = base_perf
+        self.tyre3set_life_diff = tyre3set_life_diff
+        self.tyre3set_perf_diff = tyre3set_perf_diff
+        self.base_params = base_params
+        self.steps = {**TEMPSWEAR_STEPS, **(steps or {})}
+        self.compounds = compounds
+
+    def durability(self) -> list:
+        life_mult = self.tyre3set_life_diff / 3
+        return [self.base_tyre_life - life_mult * i for i in range(self.compounds)]
+
+    def grip(self) -> list:
+        # softest compound gets the base grip, every harder one loses a step
+        perf_mult = self.tyre3set_perf_diff / 3
+        return [self.base_perf - perf_mult * (self.compounds - 1 - i) for i in range(self.compounds)]
+
+    def tempswear(self) -> dict:
+        return {
+            column: [base + i / self.steps[column] for i in range(self.compounds)]
+            for column, base in self.base_params.items()
+        }
+
+    def matrix(self) -> dict:
+        # column -> value per compound
+        return {'Durability': self.durability(), 'Grip': self.grip(), **self.tempswear()}
+
+    def defaults(self) -> dict:
+        # value for rows outside the modelled compounds, None keeps what is in the save
+        return {'Durability': None, 'Grip': None, **self.base_params}
+
+    def values(self) -> dict:
+        # column -> CASE Type WHEN 0 THEN .. ELSE default END, the whole matrix is one UPDATE
+        defaults = self.defaults()
+        values = dict()
+        for column, per_compound in self.matrix().items():
+            whens = ' '.join(['WHEN ? THEN ?'] * len(per_compound))
+            params = [param for i, value in enumerate(per_compound) for param in (i, value)]
+            if defaults[column] is None:
+                values[column] = Expr(f'CASE Type {whens} ELSE {{}} END', *params)
+            else:
+                values[column] = Expr(f'CASE Type {whens} ELSE ? END', *params, defaults[column])
+        return values
+
+    def add_to_plan(self, plan):
+        plan.update(self.tyres_table, self.values())
+
+    def rows(self) -> list:
+        matrix = self.matrix()
+        return [{'Type': i, **{column: values[i] for column, values in matrix.items()}} for i in range(self.compounds)]
+
+    def preview(self) -> str:
+        matrix = self.matrix()
+        lines = [f"{'column':<16}" + ''.join(f'{f"Type {i}":>10}' for i in range(self.compounds))]
+        for column, values in matrix.items():
+            lines.append(f'{column:<16}' + ''.join(f'{value:>10.4f}' for value in values))
+        return '\n'.join(lines)
+
+    def export(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({'steps': self.steps, 'compounds': self.rows()}, f, indent=2)
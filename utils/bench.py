@@ -0,0 +1,206 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import zlib
+from queue import Empty
+
+from instrument import peak_rss
+from script import process_unpack, process_unpack_memory, write_save, MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME
+from synth import make_save
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# synthetic save scales (drivers) benchmarked by default
+SUITE_SIZES = [200, 2000, 10000]
+# slower than the baseline by more than this is reported as a regression
+REGRESSION = 0.10
+
+
+def bench_deflate(input_file, workers_list, level=zlib.Z_DEFAULT_COMPRESSION, repeat=3):
+    # Repacks the same save with every worker count and reports the best of `repeat` runs.
+    unpacked = process_unpack_memory(input_file)
+    dbs = [unpacked.buffers[name] for name in (MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME)]
+    total = sum(map(len, dbs))
+    out_file = input_file + '.bench'
+
+    results = list()
+    try:
+        for workers in workers_list:
+            best = None
+            for _ in range(repeat):
+                _t = time.perf_counter()
+                repacked = write_save(out_file, unpacked.chunk1, dbs, level, workers)
+                elapsed = time.perf_counter() - _t
+                best = elapsed if best is None else min(best, elapsed)
+            results.append({
+                'workers': workers,
+                'level': level,
+                'seconds': best,
+                'mb_per_s': total / best / 1e6,
+                'zlib_size': repacked.zlib_size,
+            })
+    finally:
+        if os.path.exists(out_file):
+            os.remove(out_file)
+    return results
+
+
+def task_unpack_memory(save_path, _tmp_dir):
+    process_unpack_memory(save_path)
+
+
+def task_unpack_disk(save_path, tmp_dir):
+    process_unpack(save_path, tmp_dir, stream=True, selective=True)
+
+
+def task_repack(save_path, tmp_dir):
+    unpacked = process_unpack_memory(save_path)
+    dbs = [unpacked.buffers[name] for name in (MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME)]
+    _t = time.perf_counter()
+    write_save(os.path.join(tmp_dir, 'out.sav'), unpacked.chunk1, dbs)
+    return time.perf_counter() - _t
+
+
+def task_modify(save_path, tmp_dir):
+    # the whole in-memory run of main.py with its default settings: unpack, modifiers, repack
+    sys.path.insert(0, ROOT)
+    from main import SeasonChanger, MODIFIERS, build_parser, season_kwargs_from_args, load_memory_db, serialize_memory_db
+    from script import process_repack_memory
+
+    args = build_parser().parse_args([])
+    args.ratings = [os.path.join(ROOT, path) for path in args.ratings]
+    unpacked = process_unpack_memory(save_path)
+    conn, wal = load_memory_db(unpacked.buffers[MAIN_DB_NAME])
+    season = SeasonChanger(db_path=MAIN_DB_NAME, conn=conn, profile=args.db_profile, **season_kwargs_from_args(args))
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        season.run_modifiers(MODIFIERS)
+        season.apply_plan()
+    season.commit(close=False)
+    dbs = [serialize_memory_db(conn, wal), unpacked.buffers[BACKUP_DB_NAME], unpacked.buffers[BACKUP_DB2_NAME]]
+    season.close_connection()
+    process_repack_memory(unpacked.chunk1, dbs, os.path.join(tmp_dir, 'out.sav'))
+
+
+SUITE_TASKS = {
+    'unpack_memory': task_unpack_memory,
+    'unpack_disk': task_unpack_disk,
+    'repack': task_repack,
+    'modify': task_modify,
+}
+
+
+def run_task(name, save_path, queue):
+    # Runs in a fresh process so the peak memory belongs to this task alone.
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        _t = time.perf_counter()
+        seconds = SUITE_TASKS[name](save_path, tmp_dir)
+        if seconds is None:
+            seconds = time.perf_counter() - _t
+    queue.put((seconds, peak_rss()))
+
+
+def measure(name, save_path, repeat):
+    # best time and highest peak memory of `repeat` runs, each in its own spawned process
+    ctx = multiprocessing.get_context('spawn')
+    best = peak = None
+    for _ in range(repeat):
+        queue = ctx.Queue()
+        process = ctx.Process(target=run_task, args=(name, save_path, queue))
+        process.start()
+        result = None
+        while result is None:
+            # a task that raises never puts anything, don't wait on the queue once its process is gone
+            alive = process.is_alive()
+            try:
+                result = queue.get(timeout=1.0)
+            except Empty:
+                if not alive:
+                    break
+        process.join()
+        if result is None or process.exitcode:
+            raise RuntimeError(f'{name} failed on {save_path} (exit code {process.exitcode})')
+        seconds, rss = result
+        best = seconds if best is None else min(best, seconds)
+        peak = rss if peak is None else max(peak, rss or 0)
+    return {'seconds': best, 'peak_rss': peak}
+
+
+def bench_suite(sizes=SUITE_SIZES, tasks=SUITE_TASKS, repeat=3, save_dir=None, seed=0):
+    # Synthetic saves are generated once per size (and kept in save_dir when given, keyed by size and seed).
+    results = list()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        save_dir = save_dir or tmp_dir
+        os.makedirs(save_dir, exist_ok=True)
+        for drivers in sizes:
+            save_path = os.path.join(save_dir, f'synthetic-{drivers}-{seed}.sav')
+            if not os.path.exists(save_path):
+                make_save(save_path, drivers, seed)
+            for name in tasks:
+                results.append({
+                    'drivers': drivers,
+                    'save_size': os.path.getsize(save_path),
+                    'task': name,
+                    **measure(name, save_path, repeat),
+                })
+    return results
+
+
+def compare(results, baseline, threshold=REGRESSION):
+    # -> rows of (result, baseline result or None, relative change) plus the regressions among them
+    previous = {(row['drivers'], row['task']): row for row in baseline}
+    rows = list()
+    regressions = list()
+    for row in results:
+        old = previous.get((row['drivers'], row['task']))
+        change = None if old is None else row['seconds'] / old['seconds'] - 1
+        rows.append((row, old, change))
+        if change is not None and change > threshold:
+            regressions.append(row)
+    return rows, regressions
+
+
+if __name__ == '__main__':
+    # python utils/bench.py --input autosave.sav --workers 1 2 4 8
+    # python utils/bench.py --suite --sizes 200 2000 --output bench.json --baseline previous.json
+    parser = argparse.ArgumentParser(description='Benchmark F1 Manager 2022 save repacking.')
+    parser.add_argument('--input', help='Full path to the save file to benchmark with.')
+    parser.add_argument('--workers', help='Deflate worker counts to compare.', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--level', help='zlib compression level.', type=int, default=zlib.Z_DEFAULT_COMPRESSION)
+    parser.add_argument('--repeat', help='Runs per worker count (or suite task), the best one is reported.', type=int, default=3)
+    parser.add_argument('--suite', help='Run the unpack/repack/modify suite on synthetic saves instead.', action='store_true')
+    parser.add_argument('--sizes', help='Synthetic save scales (drivers) for the suite.', type=int, nargs='+', default=SUITE_SIZES)
+    parser.add_argument('--tasks', help='Suite tasks to run.', nargs='+', choices=list(SUITE_TASKS), default=list(SUITE_TASKS))
+    parser.add_argument('--save_dir', help='Keep the generated saves here and reuse them on the next run.')
+    parser.add_argument('--output', help='Write the suite results to this json file.')
+    parser.add_argument('--baseline', help='Suite results json of an earlier run to compare against.')
+    parser.add_argument('--threshold', help='Relative slowdown against the baseline reported as a regression.', type=float, default=REGRESSION)
+    args = parser.parse_args()
+
+    if not args.suite:
+        if not args.input:
+            parser.error('--input is required unless --suite is given')
+        for row in bench_deflate(args.input, args.workers, args.level, args.repeat):
+            print(f"workers={row['workers']:>3} level={row['level']:>2} {row['seconds']:.3f}s "
+                  f"{row['mb_per_s']:.1f} MB/s zlib_size={row['zlib_size']}")
+        raise SystemExit(0)
+
+    results = bench_suite(args.sizes, {name: SUITE_TASKS[name] for name in args.tasks}, args.repeat, args.save_dir)
+    baseline = list()
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    rows, regressions = compare(results, baseline, args.threshold)
+    for row, old, change in rows:
+        versus = '' if old is None else f"  {old['seconds'] * 1000:>9.1f} ms before ({change:+.0%})"
+        print(f"{row['drivers']:>7} drivers {row['task']:<14}{row['seconds'] * 1000:>9.1f} ms "
+              f"{(row['peak_rss'] or 0) / (1 << 20):>8.1f} MiB peak{versus}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%} against {args.baseline}")
+        raise SystemExit(1)
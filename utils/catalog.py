@@ -0,0 +1,198 @@
+import argparse
+import glob
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import time
+
+try:
+    from .header import CACHE_PATH, HeaderError, find_db_section, parse_header
+    from .script import iter_inflate, split_stream, MAIN_DB_NAME
+except ImportError:
+    # run as a plain script from the utils folder
+    from header import CACHE_PATH, HeaderError, find_db_section, parse_header
+    from script import iter_inflate, split_stream, MAIN_DB_NAME
+
+CATALOG_PATH = os.path.join(os.path.dirname(CACHE_PATH), 'catalog.db')
+
+# summary stats pulled from main.db on request, name -> query
+SUMMARY_QUERIES = {
+    'drivers': 'SELECT COUNT(*) FROM Staff_DriverData;',
+    'staff': 'SELECT COUNT(DISTINCT StaffID) FROM Staff_PerformanceStats;',
+    'teams': 'SELECT COUNT(*) FROM Finance_TeamBalance;',
+    'total_balance': 'SELECT SUM(Balance) FROM Finance_TeamBalance;',
+    'designs': 'SELECT COUNT(DISTINCT DesignID) FROM Parts_DesignStatValues;',
+}
+
+COLUMNS = (
+    'path', 'folder', 'name', 'size', 'mtime_ns', 'db_section_off', 'zlib_size',
+    'main_size', 'backup1_size', 'backup2_size', 'save_class', 'engine_version', 'properties', 'stats', 'indexed_at',
+)
+
+
+class SaveCatalog:
+    table: str = 'saves'
+
+    def __init__(self, catalog_path=CATALOG_PATH):
+        os.makedirs(os.path.dirname(catalog_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(catalog_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                path TEXT PRIMARY KEY, folder TEXT, name TEXT, size INTEGER, mtime_ns INTEGER,
+                db_section_off INTEGER, zlib_size INTEGER, main_size INTEGER, backup1_size INTEGER, backup2_size INTEGER,
+                save_class TEXT, engine_version TEXT, properties TEXT, stats TEXT, indexed_at REAL
+            );''')
+        self.conn.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_folder ON {self.table} (folder);')
+        # path -> error of the saves the last refresh couldn't read
+        self.unreadable = dict()
+
+    def refresh(self, folder):
+        # Only saves that are new or whose size/mtime moved get re-read, returns (indexed, removed).
+        folder = os.path.abspath(folder)
+        known = {
+            row['path']: (row['size'], row['mtime_ns'])
+            for row in self.conn.execute(f'SELECT path, size, mtime_ns FROM {self.table} WHERE folder = ?;', (folder,))
+        }
+        paths = sorted(glob.glob(os.path.join(folder, '*.sav')))
+
+        indexed = 0
+        self.unreadable = dict()
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                entry = self.read_entry(path, folder, stat)
+            except (OSError, ValueError, HeaderError, struct.error) as e:
+                # empty, truncated or still being written by the game, picked up by a later refresh once it changes
+                self.unreadable[path] = f'{type(e).__name__}: {e}'
+                continue
+            self.conn.execute(f"INSERT OR REPLACE INTO {self.table} VALUES ({', '.join('?' * len(COLUMNS))});", entry)
+            indexed += 1
+
+        # a save that became unreadable loses its old entry too, its offsets no longer hold
+        removed = [path for path in known if path not in set(paths) or path in self.unreadable]
+        self.conn.executemany(f'DELETE FROM {self.table} WHERE path = ?;', [(path,) for path in removed])
+        self.conn.commit()
+        return indexed, len(removed)
+
+    def read_entry(self, path, folder, stat):
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
+        try:
+            db_section_off, _ = find_db_section(mm, path)
+            zlib_sz, *db_sizes = struct.unpack_from('iiii', mm, db_section_off)
+            if zlib_sz <= 0 or min(db_sizes) < 0 or len(mm) < db_section_off + 16 + zlib_sz:
+                raise HeaderError(f'{path} is truncated, its size header wants {zlib_sz} compressed bytes')
+            try:
+                header = parse_header(mm)
+            except (HeaderError, UnicodeDecodeError):
+                header = {'save_class': None, 'engine_version': None, 'properties': []}
+        finally:
+            mm.close()
+
+        properties = {prop['name']: prop['value'] for prop in header['properties']}
+        return (
+            path, folder, os.path.basename(path), stat.st_size, stat.st_mtime_ns, db_section_off, zlib_sz,
+            *db_sizes, header['save_class'], header['engine_version'], json.dumps(properties), None, time.time(),
+        )
+
+    def saves(self, folder=None):
+        if folder is None:
+            rows = self.conn.execute(f'SELECT * FROM {self.table} ORDER BY mtime_ns DESC;')
+        else:
+            rows = self.conn.execute(f'SELECT * FROM {self.table} WHERE folder = ? ORDER BY mtime_ns DESC;',
+                                     (os.path.abspath(folder),))
+        return [self.to_dict(row) for row in rows]
+
+    def get(self, path):
+        row = self.conn.execute(f'SELECT * FROM {self.table} WHERE path = ?;', (os.path.abspath(path),)).fetchone()
+        return None if row is None else self.to_dict(row)
+
+    def stats(self, path):
+        # Lazily inflates only main.db (to a temporary file, bounded memory) the first time it is asked for.
+        entry = self.get(path)
+        if entry is None:
+            raise KeyError(f'{path} is not in the catalog, refresh its folder first')
+        if entry['stats'] is not None:
+            return entry['stats']
+
+        stats = read_summary(entry['path'], entry['db_section_off'], entry['main_size'])
+        self.conn.execute(f'UPDATE {self.table} SET stats = ? WHERE path = ?;', (json.dumps(stats), entry['path']))
+        self.conn.commit()
+        return stats
+
+    @staticmethod
+    def to_dict(row):
+        entry = dict(row)
+        entry['properties'] = json.loads(entry['properties'])
+        entry['stats'] = None if entry['stats'] is None else json.loads(entry['stats'])
+        return entry
+
+    def close(self):
+        self.conn.close()
+
+
+def format_entry(entry):
+    return (f"{entry['name']:<32}{entry['size']:>12}  db={entry['main_size']}/{entry['backup1_size']}/"
+            f"{entry['backup2_size']}  {time.ctime(entry['mtime_ns'] / 1e9)}  {entry['stats'] or ''}")
+
+
+def inflate_main_db(path, db_section_off, main_size, db_path):
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
+    try:
+        with open(db_path, 'wb') as db_file:
+            # main.db comes first in the stream, stop inflating once it is complete
+            for _, piece in split_stream(iter_inflate(mm, db_section_off + 16), [main_size]):
+                db_file.write(piece)
+    finally:
+        mm.close()
+
+
+def read_summary(path, db_section_off, main_size):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, MAIN_DB_NAME)
+        inflate_main_db(path, db_section_off, main_size, db_path)
+
+        stats = dict()
+        con = sqlite3.connect(db_path)
+        for name, query in SUMMARY_QUERIES.items():
+            try:
+                stats[name] = con.execute(query).fetchone()[0]
+            except sqlite3.Error:
+                stats[name] = None
+        con.close()
+    return stats
+
+
+if __name__ == '__main__':
+    # python utils/catalog.py --folder <save folder> --stats
+    parser = argparse.ArgumentParser(description='Index F1 Manager 2022 saves without unpacking them.')
+    parser.add_argument('--folder', help='Save folder to index.', required=True)
+    parser.add_argument('--stats', help='Also pull summary stats from each main.db (inflates main.db once per save).', action='store_true')
+    parser.add_argument('--json', help='Print the catalog as json.', action='store_true')
+    args = parser.parse_args()
+
+    catalog = SaveCatalog()
+    _t = time.perf_counter()
+    indexed, removed = catalog.refresh(args.folder)
+    entries = catalog.saves(args.folder)
+    if args.stats:
+        for entry in entries:
+            entry['stats'] = catalog.stats(entry['path'])
+    elapsed = time.perf_counter() - _t
+
+    if args.json:
+        print(json.dumps(entries, indent=2))
+    else:
+        for entry in entries:
+            print(format_entry(entry))
+        for path, error in catalog.unreadable.items():
+            print(f"{os.path.basename(path):<32}unreadable, skipped: {error}")
+        print(f"{len(entries)} saves, {indexed} (re)indexed, {removed} removed in {elapsed * 1000:.1f} ms")
+    catalog.close()
@@ -0,0 +1,206 @@
+import json
+import math
+import os
+import time
+import zipfile
+import zlib
+from array import array
+
+try:
+    from .savefile import atomic_write
+except ImportError:
+    # run as a plain script from the utils folder
+    from savefile import atomic_write
+
+# Tables of many saves in one zip file, one segment per save (keyed by the content hash of its DB section):
+#   manifest.json                        saves and, per save, the rows and column kinds of every table
+#   <save key>/<table>/<column>          zlib compressed array bytes, 'int' as int64, 'float' as float64 (NaN for NULL)
+#   <save key>/<table>/<column>.dict     for 'str' columns the distinct values, the column holds int32 codes (-1 for NULL)
+# Members are stored uncompressed in the zip since they are compressed already, so adding saves copies the
+# existing segments byte for byte instead of re-encoding them.
+
+MANIFEST_NAME = 'manifest.json'
+VERSION = 1
+KINDS = {'int': 'q', 'float': 'd', 'str': 'i'}
+# members are small, level 6 costs little over 1 and saves a good deal on the float columns
+LEVEL = 6
+
+
+def column_kind(values):
+    kind = 'int'
+    for value in values:
+        if value is None:
+            if kind == 'int':
+                kind = 'float'
+        elif isinstance(value, (str, bytes)):
+            return 'str'
+        elif isinstance(value, float) and kind == 'int':
+            kind = 'float'
+    return kind
+
+
+def text(value):
+    # 'str' columns hold BLOBs as hex strings, and the numbers of a loosely typed column as their text
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def encode_column(values):
+    # -> (kind, member bytes, distinct values for 'str' or None)
+    kind = column_kind(values)
+    if kind == 'int':
+        data = array('q', values)
+        distinct = None
+    elif kind == 'float':
+        data = array('d', [math.nan if value is None else value for value in values])
+        distinct = None
+    else:
+        codes = dict()
+        data = array('i', [-1 if value is None else codes.setdefault(text(value), len(codes)) for value in values])
+        distinct = list(codes)
+    return kind, zlib.compress(data.tobytes(), LEVEL), distinct
+
+
+def decode_column(kind, data, distinct=None):
+    values = array(KINDS[kind])
+    values.frombytes(zlib.decompress(data))
+    if kind != 'str':
+        return values
+    return [None if code < 0 else distinct[code] for code in values]
+
+
+def encode_table(names, rows):
+    # -> (table entry for the manifest, {member suffix: bytes})
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    entry = {'rows': len(rows), 'columns': dict()}
+    members = dict()
+    for name, values in zip(names, columns):
+        kind, data, distinct = encode_column(values)
+        entry['columns'][name] = kind
+        members[name] = data
+        if distinct is not None:
+            members[f'{name}.dict'] = json.dumps(distinct).encode()
+    return entry, members
+
+
+class ColumnStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.zip = None
+        self.open()
+
+    def open(self):
+        self.manifest = {'version': VERSION, 'saves': dict()}
+        self.cache = dict()
+        if os.path.exists(self.path):
+            self.zip = zipfile.ZipFile(self.path, 'r')
+            self.manifest = json.loads(self.zip.read(MANIFEST_NAME))
+
+    def __contains__(self, key):
+        return key in self.manifest['saves']
+
+    def saves(self):
+        # oldest first, by in-game day where the save has one, then by file time
+        entries = [dict(meta, key=key) for key, meta in self.manifest['saves'].items()]
+        return sorted(entries, key=lambda meta: (meta.get('day') is None, meta.get('day') or 0, meta['mtime']))
+
+    def column(self, key, table, name):
+        cached = self.cache.get((key, table, name))
+        if cached is None:
+            kind = self.manifest['saves'][key]['tables'][table]['columns'][name]
+            distinct = json.loads(self.zip.read(f'{key}/{table}/{name}.dict')) if kind == 'str' else None
+            cached = self.cache[(key, table, name)] = decode_column(kind, self.zip.read(f'{key}/{table}/{name}'), distinct)
+        return cached
+
+    def segments(self, table, saves=None):
+        # save keys holding table, in saves() order
+        wanted = None if saves is None else set(saves)
+        return [meta['key'] for meta in self.saves()
+                if table in meta['tables'] and (wanted is None or meta['key'] in wanted or meta['name'] in wanted)]
+
+    def table(self, table, columns=None, saves=None):
+        # -> {column: values of every save one after the other, 'save': the save key of every row}
+        keys = self.segments(table, saves)
+        names = columns or sorted({name for key in keys for name in self.manifest['saves'][key]['tables'][table]['columns']})
+        result = {name: list() for name in names}
+        result['save'] = list()
+        for key in keys:
+            entry = self.manifest['saves'][key]['tables'][table]
+            for name in names:
+                if name in entry['columns']:
+                    result[name].extend(self.column(key, table, name))
+                else:
+                    result[name].extend([None] * entry['rows'])
+            result['save'].extend([key] * entry['rows'])
+        return result
+
+    def groups(self, key, table, names):
+        # {group values: row indices} for one save, built once per set of columns and reused by later queries
+        cached = self.cache.get((key, table, tuple(names)))
+        if cached is None:
+            cached = dict()
+            columns = [self.column(key, table, name) for name in names]
+            rows = zip(*columns) if columns else ((),) * self.manifest['saves'][key]['tables'][table]['rows']
+            for i, group in enumerate(rows):
+                cached.setdefault(group, list()).append(i)
+            self.cache[(key, table, tuple(names))] = cached
+        return cached
+
+    def aggregate(self, table, value, by=(), saves=None, agg='mean', where=None):
+        # -> [(save meta, {group: aggregated value})], where filters on column equality, e.g. {'StatID': 2}
+        functions = {
+            'mean': lambda values: math.fsum(values) / len(values),
+            'sum': math.fsum,
+            'min': min,
+            'max': max,
+            'count': len,
+        }
+        if agg not in functions:
+            raise ValueError(f'unknown aggregate "{agg}", expected one of {", ".join(functions)}')
+        where = where or {}
+        # the filter columns are grouped on as well, the groups that don't match are dropped
+        names = list(by) + [name for name in where if name not in by]
+        wanted = [(names.index(name), expected) for name, expected in where.items()]
+        metas = {meta['key']: meta for meta in self.saves()}
+        result = list()
+        for key in self.segments(table, saves):
+            values = self.column(key, table, value)
+            nullable = self.manifest['saves'][key]['tables'][table]['columns'][value] != 'int'
+            merged = dict()
+            for group, rows in self.groups(key, table, names).items():
+                if any(group[i] != expected for i, expected in wanted):
+                    continue
+                found = [values[i] for i in rows]
+                if nullable:
+                    found = [current for current in found if current is not None and current == current]
+                merged.setdefault(group[:len(by)], list()).extend(found)
+            result.append((metas[key], {group: functions[agg](found) for group, found in sorted(merged.items()) if found}))
+        return result
+
+    def write(self, segments):
+        # segments: {save key: (save meta, {table: (table entry, members)})}, rewrites the store with them added
+        manifest = {'version': VERSION, 'saves': dict(self.manifest['saves'])}
+        with atomic_write(self.path) as f, zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED) as out:
+            if self.zip is not None:
+                for info in self.zip.infolist():
+                    if info.filename != MANIFEST_NAME:
+                        out.writestr(info, self.zip.read(info))
+            for key, (meta, tables) in segments.items():
+                meta = dict(meta, tables=dict(), exported_at=time.time())
+                for table, (entry, members) in tables.items():
+                    meta['tables'][table] = entry
+                    for suffix, data in members.items():
+                        out.writestr(f'{key}/{table}/{suffix}', data)
+                manifest['saves'][key] = meta
+            out.writestr(MANIFEST_NAME, json.dumps(manifest))
+        self.close()
+        self.open()
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+            self.zip = None
@@ -0,0 +1,170 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+# Decompressed databases keyed by the hash of the compressed DB section (size header + zlib stream).
+# Entries are folders holding main.db/backup1.db/backup2.db, their mtime is the LRU clock.
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'f1manager22', 'dbs')
+CACHE_SIZE = 1 << 30
+STATS_NAME = 'stats.json'
+
+
+class DBCache:
+
+    def __init__(self, folder=CACHE_DIR, max_size=CACHE_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        os.makedirs(self.folder, exist_ok=True)
+
+    @staticmethod
+    def key(mm, db_section_off, zlib_sz):
+        return hashlib.blake2b(mm[db_section_off:db_section_off + 16 + zlib_sz], digest_size=20).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.folder, key)
+
+    def lookup(self, key, db_sizes: dict):
+        # Entry folder when every database is there with the size the header expects, None otherwise.
+        path = self.entry_path(key)
+        try:
+            for name, size in db_sizes.items():
+                if size and os.path.getsize(os.path.join(path, name)) != size:
+                    raise OSError(f'{name} size mismatch')
+        except OSError:
+            shutil.rmtree(path, ignore_errors=True)
+            self.count('misses')
+            return None
+        os.utime(path)
+        self.count('hits')
+        return path
+
+    def copy_to(self, key, db_sizes: dict, to_folder, names=None):
+        # Copies the databases (or just names) into to_folder, returns the entry folder or None on a miss.
+        path = self.lookup(key, db_sizes)
+        if path is None:
+            return None
+        for name, size in db_sizes.items():
+            if size == 0:
+                break
+            if names is None or name in names:
+                # copy, the working main.db is modified in place and must not touch the cache
+                shutil.copyfile(os.path.join(path, name), os.path.join(to_folder, name))
+        return path
+
+    def read(self, key, db_sizes: dict):
+        path = self.lookup(key, db_sizes)
+        if path is None:
+            return None
+        buffers = dict()
+        for name, size in db_sizes.items():
+            buffers[name] = bytearray(size)
+            if size:
+                with open(os.path.join(path, name), 'rb') as f:
+                    f.readinto(buffers[name])
+        return buffers
+
+    def put(self, key, sources: dict):
+        # sources: name -> file path or buffer. Written to a temporary folder first, so a reader never
+        # sees half an entry and two processes storing the same save don't collide.
+        path = self.entry_path(key)
+        if os.path.isdir(path):
+            return
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(tmp_path, exist_ok=True)
+            for name, source in sources.items():
+                if isinstance(source, str):
+                    if os.path.exists(source):
+                        shutil.copyfile(source, os.path.join(tmp_path, name))
+                else:
+                    with open(os.path.join(tmp_path, name), 'wb') as f:
+                        f.write(source)
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return  # the cache is only an optimisation
+        self.evict()
+
+    def entries(self):
+        # (mtime, size, path) of every entry, least recently used first
+        entries = list()
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if not os.path.isdir(path) or name.endswith('.tmp'):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            entries.append((os.stat(path).st_mtime, size, path))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        # the newest entry is kept even when it alone is over the cap
+        for _, size, path in entries[:-1]:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            evicted += 1
+        if evicted:
+            self.count('evictions', evicted)
+
+    def stats(self):
+        try:
+            with open(os.path.join(self.folder, STATS_NAME), 'r') as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = dict()
+        entries = self.entries()
+        return {
+            'hits': stats.get('hits', 0),
+            'misses': stats.get('misses', 0),
+            'evictions': stats.get('evictions', 0),
+            'entries': len(entries),
+            'size': sum(size for _, size, _ in entries),
+            'max_size': self.max_size,
+        }
+
+    def count(self, name, n=1):
+        stats_path = os.path.join(self.folder, STATS_NAME)
+        try:
+            with open(stats_path, 'r') as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = dict()
+        stats[name] = stats.get(name, 0) + n
+        try:
+            tmp_path = f'{stats_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(stats, f)
+            os.replace(tmp_path, stats_path)
+        except OSError:
+            pass
+
+    def clear(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        os.makedirs(self.folder, exist_ok=True)
+
+
+if __name__ == '__main__':
+    # python utils/dbcache.py --stats / --clear
+    parser = argparse.ArgumentParser(description='Inspect or clear the decompressed database cache.')
+    parser.add_argument('--folder', help='Cache folder.', default=CACHE_DIR)
+    parser.add_argument('--max_size', help='Cache size cap in MiB.', type=int, default=CACHE_SIZE >> 20)
+    parser.add_argument('--stats', help='Print hit/miss counts and the cache size.', action='store_true')
+    parser.add_argument('--clear', help='Delete every cached database and reset the stats.', action='store_true')
+    args = parser.parse_args()
+
+    cache = DBCache(args.folder, args.max_size << 20)
+    if args.clear:
+        cache.clear()
+        print(f'Cleared {args.folder}')
+    if args.stats or not args.clear:
+        stats = cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = f" ({stats['hits'] / lookups:.0%} hit rate)" if lookups else ''
+        print(f"{stats['entries']} entries, {stats['size'] / (1 << 20):.1f} of {stats['max_size'] / (1 << 20):.0f} MiB, "
+              f"{stats['hits']} hits / {stats['misses']} misses{hit_rate}, {stats['evictions']} evicted")
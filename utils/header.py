@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import struct
+import time
+
+# chunk1 is an Unreal GVAS save header followed by a property list, the DB section starts right after it.
+GVAS_MAGIC = b'GVAS'
+NONE_NAME = 'None'
+# None None just before the packed DB Section.
+NONE_NONE_SIG = b'\x00\x05\x00\x00\x00\x4E\x6F\x6E\x65\x00\x05\x00\x00\x00\x4E\x6F\x6E\x65\x00'
+UNK_SIZE = 4  # Unk 4 Bytes between the signature and the size header
+
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'f1manager22', 'db_offsets.json')
+CACHE_LIMIT = 64
+
+
+class HeaderError(ValueError):
+    pass
+
+
+class Reader:
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def take(self, size):
+        if size < 0 or self.pos + size > len(self.data):
+            raise HeaderError(f'read of {size} bytes at {self.pos} runs past the end')
+        start = self.pos
+        self.pos += size
+        return self.data[start:self.pos]
+
+    def unpack(self, fmt):
+        return struct.unpack(fmt, self.take(struct.calcsize(fmt)))
+
+    def int32(self):
+        return self.unpack('<i')[0]
+
+    def fstring(self):
+        # int32 length including the terminator, negative means UTF-16
+        length = self.int32()
+        if length == 0:
+            return ''
+        if length > 0:
+            if length > 1 << 16:
+                raise HeaderError(f'implausible string length {length} at {self.pos - 4}')
+            return bytes(self.take(length)[:-1]).decode('latin-1')
+        if -length > 1 << 16:
+            raise HeaderError(f'implausible string length {length} at {self.pos - 4}')
+        return bytes(self.take(-length * 2)[:-2]).decode('utf-16-le')
+
+
+def read_property_value(reader, prop_type, size):
+    # Only scalar values are decoded, everything else is skipped by its size.
+    if prop_type == 'IntProperty' and size == 4:
+        return reader.int32()
+    if prop_type == 'Int64Property' and size == 8:
+        return reader.unpack('<q')[0]
+    if prop_type == 'FloatProperty' and size == 4:
+        return reader.unpack('<f')[0]
+    if prop_type in ('StrProperty', 'NameProperty'):
+        end = reader.pos + size
+        value = reader.fstring()
+        reader.pos = end
+        return value
+    reader.take(size)
+    return None
+
+
+def read_properties(reader):
+    properties = list()
+    while True:
+        name = reader.fstring()
+        if name == NONE_NAME:
+            return properties
+        prop_type = reader.fstring()
+        size, _array_index = reader.unpack('<ii')
+        value = None
+        if prop_type == 'StructProperty':
+            reader.fstring()
+            reader.take(16)
+        elif prop_type == 'BoolProperty':
+            value = bool(reader.take(1)[0])
+        elif prop_type in ('ByteProperty', 'EnumProperty', 'ArrayProperty', 'SetProperty'):
+            reader.fstring()
+        elif prop_type == 'MapProperty':
+            reader.fstring()
+            reader.fstring()
+        if reader.take(1)[0]:
+            reader.take(16)  # property guid
+        offset = reader.pos
+        parsed = read_property_value(reader, prop_type, size)
+        properties.append({
+            'name': name,
+            'type': prop_type,
+            'size': size,
+            'offset': offset,
+            'value': value if parsed is None else parsed,
+        })
+
+
+def parse_header(data):
+    reader = Reader(data)
+    if bytes(reader.take(4)) != GVAS_MAGIC:
+        raise HeaderError('not a GVAS save')
+
+    save_game_version, package_version = reader.unpack('<ii')
+    major, minor, patch, changelist = reader.unpack('<HHHI')
+    branch = reader.fstring()
+    custom_version_format = reader.int32()
+    custom_versions = reader.int32()
+    if not 0 <= custom_versions < 4096:
+        raise HeaderError(f'implausible custom version count {custom_versions}')
+    reader.take(custom_versions * 20)  # guid + int32 each
+    save_class = reader.fstring()
+
+    properties = read_properties(reader)
+    # the DB section follows the closing None(s) and the 4 unknown bytes
+    while True:
+        mark = reader.pos
+        try:
+            if reader.fstring() == NONE_NAME:
+                continue
+        except HeaderError:
+            pass
+        reader.pos = mark
+        break
+    db_section_off = reader.pos + UNK_SIZE
+
+    return {
+        'save_game_version': save_game_version,
+        'package_version': package_version,
+        'engine_version': f'{major}.{minor}.{patch}-{changelist}+{branch}',
+        'custom_version_format': custom_version_format,
+        'save_class': save_class,
+        'properties': properties,
+        'db_section_off': db_section_off,
+    }
+
+
+def check_db_section(mm, db_section_off):
+    # Same invariant the signature scan relies on, plus a sane size header and zlib magic.
+    # (minus the leading byte, that's just whatever the property list ended with)
+    sig = NONE_NONE_SIG[1:]
+    sig_end = db_section_off - UNK_SIZE
+    if sig_end < len(sig) or mm[sig_end - len(sig):sig_end] != sig:
+        return False
+    if db_section_off + 16 >= len(mm):
+        return False
+    zlib_sz = struct.unpack_from('<i', mm, db_section_off)[0]
+    return 0 < zlib_sz <= len(mm) - db_section_off - 16 and mm[db_section_off + 16] == 0x78
+
+
+def scan_db_section(mm):
+    found = mm.find(NONE_NONE_SIG)
+    if found < 0:
+        raise HeaderError("Can't find the DB section signature")
+    return found + len(NONE_NONE_SIG) + UNK_SIZE
+
+
+def load_cache():
+    try:
+        with open(CACHE_PATH, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def store_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        # keep the most recently stored entries only
+        entries = sorted(cache.items(), key=lambda item: item[1]['stored'])[-CACHE_LIMIT:]
+        tmp_path = f'{CACHE_PATH}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(entries), f)
+        os.replace(tmp_path, CACHE_PATH)
+    except OSError:
+        pass  # the cache is only an optimisation
+
+
+def chunk1_hash(mm, db_section_off):
+    return hashlib.blake2b(mm[:db_section_off], digest_size=16).hexdigest()
+
+
+def find_db_section(mm, path=None):
+    # Returns (db_section_off, how it was found): 'cache', 'header' or 'scan'.
+    cache = key = stat = None
+    if path is not None:
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        cache = load_cache()
+        entry = cache.get(key)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns \
+                and entry['off'] < len(mm) and chunk1_hash(mm, entry['off']) == entry['hash']:
+            return entry['off'], 'cache'
+
+    try:
+        db_section_off = parse_header(mm)['db_section_off']
+        source = 'header'
+        if not check_db_section(mm, db_section_off):
+            raise HeaderError('parsed offset does not point at a DB section')
+    except (HeaderError, UnicodeDecodeError):
+        db_section_off = scan_db_section(mm)
+        source = 'scan'
+
+    if cache is not None:
+        cache[key] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'off': db_section_off,
+            'hash': chunk1_hash(mm, db_section_off),
+            'stored': time.time(),
+        }
+        store_cache(cache)
+    return db_section_off, source
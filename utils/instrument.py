@@ -0,0 +1,174 @@
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak memory is left out of the report there
+    resource = None
+
+# sqlite VM instructions between two progress callbacks
+PROGRESS_STEPS = 1000
+
+
+def peak_rss():
+    # Peak resident set size of this process in bytes, None where it can't be read.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Stages(dict):
+    # stage -> wall seconds, as the timings dicts always were; CPU seconds of the same stages are in .cpu
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cpu = dict()
+        self.mark = None
+
+    def start(self):
+        self.mark = (time.perf_counter(), time.process_time())
+
+    def stop(self, name):
+        wall, cpu = self.mark
+        self[name] = time.perf_counter() - wall
+        self.cpu[name] = time.process_time() - cpu
+        return self[name]
+
+    def report(self):
+        return {name: {'wall': wall, 'cpu': self.cpu.get(name)} for name, wall in self.items()}
+
+
+class SQLCounter:
+    # Counts executed statements (trace callback) and VM steps (progress handler) on a connection.
+
+    def __init__(self, conn, progress_steps=PROGRESS_STEPS):
+        self.conn = conn
+        self.progress_steps = progress_steps
+        self.statements = 0
+        self.vm_steps = 0
+        self.rows = conn.total_changes
+        conn.set_trace_callback(self.trace)
+        conn.set_progress_handler(self.progress, progress_steps)
+
+    def trace(self, _sql):
+        self.statements += 1
+
+    def progress(self):
+        self.vm_steps += self.progress_steps
+        return 0
+
+    def snapshot(self):
+        try:
+            self.rows = self.conn.total_changes
+        except sqlite3.ProgrammingError:
+            pass  # closed by the stage (e.g. commit), keep the last count
+        return self.statements, self.vm_steps, self.rows
+
+    def detach(self):
+        try:
+            self.conn.set_trace_callback(None)
+            self.conn.set_progress_handler(None, self.progress_steps)
+        except sqlite3.ProgrammingError:
+            pass
+
+
+class Instrument:
+    # Wall/CPU time per stage, sqlite statement/VM step/row counts for stages run on an attached
+    # connection, peak memory, and optionally a cProfile or tracemalloc capture of the whole run.
+
+    def __init__(self, profile=False, trace_memory=False):
+        self.stages = dict()
+        self.counter = None
+        self.profiler = cProfile.Profile() if profile else None
+        self.trace_memory = trace_memory
+        self.started = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def attach(self, conn):
+        if self.counter is not None:
+            self.counter.detach()
+        self.counter = SQLCounter(conn)
+
+    def detach(self):
+        if self.counter is not None:
+            self.counter.detach()
+            self.counter = None
+
+    @contextlib.contextmanager
+    def stage(self, name, **extra):
+        # extra values (e.g. planned entries) can be filled in by the caller through the yielded dict
+        entry = dict(extra)
+        before = self.counter.snapshot() if self.counter is not None else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield entry
+        finally:
+            entry['wall'] = time.perf_counter() - wall
+            entry['cpu'] = time.process_time() - cpu
+            if before is not None and self.counter is not None:
+                statements, vm_steps, rows = self.counter.snapshot()
+                entry['statements'] = statements - before[0]
+                entry['vm_steps'] = vm_steps - before[1]
+                entry['rows'] = rows - before[2]
+            entry['peak_rss'] = peak_rss()
+            self.stages[name] = entry
+
+    def add(self, name, timings):
+        # Sub-stages recorded by utils/script.py (a Stages dict on the Unpack/RepackResult).
+        parts = timings.report() if isinstance(timings, Stages) else {part: {'wall': wall} for part, wall in timings.items()}
+        self.stages.setdefault(name, dict())['parts'] = parts
+
+    def report(self, top=25):
+        report = {
+            'wall': None if self.started is None else time.perf_counter() - self.started,
+            'cpu': time.process_time(),
+            'peak_rss': peak_rss(),
+            'stages': self.stages,
+        }
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            report['tracemalloc'] = {
+                'current': current,
+                'peak': peak,
+                'top': [
+                    {'where': str(stat.traceback), 'size': stat.size, 'count': stat.count}
+                    for stat in snapshot.statistics('lineno')[:top]
+                ],
+            }
+        if self.profiler is not None:
+            self.profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(top)
+            report['profile'] = out.getvalue()
+        return report
+
+    def write(self, path, top=25):
+        # The json report, plus <path>.prof for snakeviz/pstats when profiling.
+        report = self.report(top)
+        if self.profiler is not None:
+            report['profile_file'] = os.path.splitext(path)[0] + '.prof'
+            self.profiler.dump_stats(report['profile_file'])
+        if self.trace_memory:
+            tracemalloc.stop()
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        return report
@@ -0,0 +1,154 @@
+import contextlib
+import glob
+import os
+import re
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, backups go straight to hardlink/copy there
+    fcntl = None
+
+# linux/fs.h _IOW(0x94, 9, int), shares the extents of a file on btrfs/xfs/bcachefs
+FICLONE = 0x40049409
+# a save keeps its previous versions as <save>.bak1 (newest) .. <save>.bak<keep>
+BACKUP_SUFFIX = '.bak'
+
+
+def fsync_dir(folder):
+    # makes a rename in the folder durable, directories can't be opened for this on Windows
+    if os.name != 'posix':
+        return
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def atomic_write(path, before_replace=()):
+    # Yields a binary file next to path that replaces it only once fully written and synced,
+    # a crash or an exception mid-write leaves the old file as it was.
+    # before_replace: callables run in order with the finished temporary path right before the rename,
+    # one raising leaves the old file in place as well.
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w+b') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        for hook in before_replace or ():
+            hook(tmp_path)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    fsync_dir(folder)
+
+
+class SaveChanged(Exception):
+    pass
+
+
+def signature(path):
+    # changes whenever the file is rewritten in place or replaced, None once it is gone
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class ExpectUnchanged:
+    # atomic_write hook refusing the rename when path is no longer the file that was read (its signature
+    # taken before the unpack), e.g. because the game wrote a newer save in the meantime.
+
+    def __init__(self, path, expected):
+        self.path = path
+        self.expected = expected
+
+    def __call__(self, tmp_path):
+        if signature(self.path) != self.expected:
+            raise SaveChanged(f'{self.path} changed while it was being modded')
+
+
+def reflink(src, dst):
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def clone_file(src, dst, hardlink=False):
+    # Cheapest copy the filesystem allows -> 'reflink', 'hardlink' or 'copy'.
+    # The game rewrites its saves itself, so a hardlink is only safe right before src is replaced
+    # by rename (see SaveBackup), any other time it falls back to a copy.
+    if fcntl is not None:
+        try:
+            reflink(src, dst)
+            return 'reflink'
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(dst)
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+def backup_path(path, generation):
+    return f'{path}{BACKUP_SUFFIX}{generation}'
+
+
+def backups(path):
+    # -> [(generation, backup path)] oldest generation last
+    pattern = re.compile(re.escape(os.path.basename(path) + BACKUP_SUFFIX) + r'(\d+)$')
+    found = list()
+    for candidate in glob.glob(glob.escape(path) + BACKUP_SUFFIX + '*'):
+        match = pattern.match(os.path.basename(candidate))
+        if match:
+            found.append((int(match.group(1)), candidate))
+    return sorted(found)
+
+
+def backup_save(path, keep, hardlink=False):
+    # Shifts the older generations up by one and clones the current save into <save>.bak1,
+    # returns how it was cloned or None when there is nothing to back up (or keep is 0).
+    if keep <= 0 or not os.path.exists(path):
+        return None
+    for generation, candidate in reversed(backups(path)):
+        if generation >= keep:
+            os.remove(candidate)
+        else:
+            os.replace(candidate, backup_path(path, generation + 1))
+    method = clone_file(path, backup_path(path, 1), hardlink)
+    fsync_dir(os.path.dirname(os.path.abspath(path)))
+    return method
+
+
+class SaveBackup:
+    # atomic_write hook keeping the save about to be replaced as <save>.bak1. It runs once the new save
+    # is complete and synced, so a hardlink only ever shares the old save's inode with the backup for the
+    # moment until the rename, and a failed write leaves the generations untouched.
+
+    def __init__(self, path, keep):
+        self.path = path
+        self.keep = keep
+        # 'reflink', 'hardlink' or 'copy' once the backup is taken
+        self.method = None
+
+    def __call__(self, tmp_path):
+        self.method = backup_save(self.path, self.keep, hardlink=True)
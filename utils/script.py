@@ -1,20 +1,264 @@
 import argparse
 import os
+import tempfile
 import zlib
 import struct
 import mmap
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+try:
+    from .header import find_db_section
+    from .dbcache import DBCache
+    from .instrument import Stages
+    from .savefile import atomic_write
+    from .verify import SaveVerifier
+except ImportError:
+    # run as a plain script from the utils folder
+    from header import find_db_section
+    from dbcache import DBCache
+    from instrument import Stages
+    from savefile import atomic_write
+    from verify import SaveVerifier
 
 CHNUK1_NAME = "chunk1"
 MAIN_DB_NAME = "main.db"
 BACKUP_DB_NAME = "backup1.db"
 BACKUP_DB2_NAME = "backup2.db"
 
+# Upper bound for a single read/inflate step when streaming.
+CHUNK_SIZE = 1 << 20
+
+# Selective unpack: backups up to this size stay in memory, bigger ones go to an anonymous temporary file.
+SPILL_SIZE = 64 << 20
+
+# Parallel deflate: input block per worker task and the preset dictionary carried between blocks.
+BLOCK_SIZE = 1 << 20
+DICT_SIZE = 1 << 15
+ADLER_BASE = 65521
+
+
+@dataclass
+class UnpackResult:
+    db_section_off: int
+    zlib_size: int
+    db_sizes: dict
+    chunk1: bytes = field(repr=False)
+    timings: dict = field(default_factory=dict)
+    # 'cache', 'header' or 'scan', how the DB section was located
+    header_source: str = 'scan'
+    # Decompressed databases by name, filled by the in-memory unpack (all three) and the selective one (backups).
+    buffers: dict = field(default_factory=dict, repr=False)
+    # 'hit' or 'miss' when a DBCache was consulted
+    cache: str = None
+
+
+@dataclass
+class RepackResult:
+    zlib_size: int
+    db_sizes: dict
+    timings: dict = field(default_factory=dict)
+    # crc32 of every database as handed to the repack, for verify.verify_save
+    db_crcs: dict = field(default_factory=dict, repr=False)
+    # verify.VerifyResult of the written save when the repack verified it before the rename
+    verified: object = field(default=None, repr=False)
+
 
 def create_db(fname, decompressed_db, _start, _end):
     with open(fname, 'wb') as f:
         f.write(decompressed_db[_start:_end])
 
 
+def iter_inflate(data, start=0, chunk_size=CHUNK_SIZE):
+    # Yields the decompressed stream in pieces of at most chunk_size bytes.
+    decompressor = zlib.decompressobj()
+    view = memoryview(data)
+    try:
+        for pos in range(start, len(view), chunk_size):
+            buf = view[pos:pos + chunk_size]
+            while buf:
+                out = decompressor.decompress(buf, chunk_size)
+                if out:
+                    yield out
+                buf = decompressor.unconsumed_tail
+            if decompressor.eof:
+                break
+    finally:
+        view.release()
+
+    if not decompressor.eof:
+        # Same failure zlib.decompress() reports for a cut-off payload.
+        raise zlib.error("Error -5 while decompressing data: incomplete or truncated stream")
+    out = decompressor.flush()
+    if out:
+        yield out
+
+
+def split_stream(chunks, db_sizes):
+    # Cuts the inflated stream at the DB boundaries, yields (db index, piece).
+    chunks = iter(chunks)
+    pending = memoryview(b'')
+    for index, db_size in enumerate(db_sizes):
+        if db_size == 0:
+            break
+        remaining = db_size
+        while remaining:
+            if not pending:
+                pending = memoryview(next(chunks, b''))
+                if not pending:
+                    return
+            piece = pending[:remaining]
+            yield index, piece
+            remaining -= len(piece)
+            pending = pending[len(piece):]
+
+
+def create_dbs_stream(databases, chunks):
+    files = dict()
+    try:
+        for index, piece in split_stream(chunks, list(databases.values())):
+            if index not in files:
+                files[index] = open(list(databases)[index], 'wb')
+            files[index].write(piece)
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def spill_buffer(size, spill_size=SPILL_SIZE):
+    if size <= spill_size:
+        return bytearray(size)
+    # unlinked file, only reachable through the mapping and gone once it is closed
+    with tempfile.TemporaryFile() as f:
+        f.truncate(size)
+        return mmap.mmap(f.fileno(), size)
+
+
+def create_dbs_selective(main_path, db_sizes, chunks, spill_size=SPILL_SIZE):
+    # main.db goes to main_path, the backups into spill buffers that are handed straight to the repack.
+    backups = [spill_buffer(db_size, spill_size) if db_size > 0 else bytearray() for db_size in db_sizes[1:]]
+    filled = [0] * len(backups)
+    with open(main_path, 'wb') as f:
+        for index, piece in split_stream(chunks, db_sizes):
+            if index == 0:
+                f.write(piece)
+            else:
+                backups[index - 1][filled[index - 1]:filled[index - 1] + len(piece)] = piece
+                filled[index - 1] += len(piece)
+    return [buffer[:size] if size < len(buffer) else buffer for buffer, size in zip(backups, filled)]
+
+
+def create_dbs_memory(db_sizes, chunks):
+    buffers = [bytearray(db_size) if db_size > 0 else bytearray() for db_size in db_sizes]
+    filled = [0] * len(db_sizes)
+    for index, piece in split_stream(chunks, db_sizes):
+        buffers[index][filled[index]:filled[index] + len(piece)] = piece
+        filled[index] += len(piece)
+    # A short stream leaves the tail of a DB missing, same as slicing would.
+    return [buffer[:size] if size < len(buffer) else buffer for buffer, size in zip(buffers, filled)]
+
+
+def iter_deflate(buffers, chunk_size=CHUNK_SIZE, level=zlib.Z_DEFAULT_COMPRESSION):
+    # Compresses the buffers as one zlib stream without joining them first.
+    compressor = zlib.compressobj(level)
+    for buf in buffers:
+        view = memoryview(buf)
+        try:
+            for pos in range(0, len(view), chunk_size):
+                out = compressor.compress(view[pos:pos + chunk_size])
+                if out:
+                    yield out
+        finally:
+            view.release()
+    yield compressor.flush()
+
+
+def adler32_combine(adler1, adler2, len2):
+    # Port of zlib's adler32_combine(), python's zlib module doesn't expose it.
+    rem = len2 % ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1) % ADLER_BASE
+    sum1 += (adler2 & 0xffff) + ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + ADLER_BASE - rem
+    if sum1 >= ADLER_BASE:
+        sum1 -= ADLER_BASE
+    if sum1 >= ADLER_BASE:
+        sum1 -= ADLER_BASE
+    if sum2 >= (ADLER_BASE << 1):
+        sum2 -= (ADLER_BASE << 1)
+    if sum2 >= ADLER_BASE:
+        sum2 -= ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def zlib_header(level):
+    # CMF 0x78 (deflate, 32K window) and FLG carrying the FLEVEL hint like zlib writes it.
+    if level == zlib.Z_DEFAULT_COMPRESSION:
+        level = 6
+    flevel = 0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3
+    cmf, flg = 0x78, flevel << 6
+    flg += 31 - ((cmf << 8) + flg) % 31
+    return bytes((cmf, flg))
+
+
+def iter_blocks(buffers, block_size):
+    # Yields (block, last 32K of everything before it, is last block).
+    blocks = (
+        view[pos:pos + block_size]
+        for view in map(memoryview, buffers)
+        for pos in range(0, len(view), block_size)
+    )
+    zdict = b''
+    block = next(blocks, None)
+    while block is not None:
+        next_block = next(blocks, None)
+        yield block, zdict, next_block is None
+        if len(block) >= DICT_SIZE:
+            zdict = bytes(block[-DICT_SIZE:])
+        else:
+            zdict = (zdict + bytes(block))[-DICT_SIZE:]
+        block = next_block
+
+
+def deflate_block(block, zdict, level, last):
+    # Raw deflate of one block primed with the previous block's tail, byte aligned with a sync flush.
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    out = compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return out, zlib.adler32(block), len(block)
+
+
+def iter_deflate_parallel(buffers, workers, level=zlib.Z_DEFAULT_COMPRESSION, block_size=BLOCK_SIZE):
+    # pigz style: blocks are deflated concurrently (zlib drops the GIL) and stitched into one zlib stream.
+    yield zlib_header(level)
+
+    adler = 1
+    blocks_count = 0
+    in_flight = list()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for block, zdict, last in iter_blocks(buffers, block_size):
+            blocks_count += 1
+            in_flight.append(pool.submit(deflate_block, block, zdict, level, last))
+            # Keep a bounded window of blocks in memory, emit in order.
+            if len(in_flight) < workers * 2:
+                continue
+            out, block_adler, block_len = in_flight.pop(0).result()
+            adler = adler32_combine(adler, block_adler, block_len)
+            yield out
+
+        for future in in_flight:
+            out, block_adler, block_len = future.result()
+            adler = adler32_combine(adler, block_adler, block_len)
+            yield out
+
+    if not blocks_count:
+        # Nothing to compress, still emit a valid (empty) final block.
+        yield deflate_block(b'', b'', level, True)[0]
+    yield struct.pack(">I", adler)
+
+
 def get_db_mmap(path):
     if not os.path.exists(path):
         return b''
@@ -51,48 +295,183 @@ def pack_databases(_dir):
     return result
 
 
-def do_pack(from_folder, to_file):
+def do_pack(from_folder, to_file, before_replace=(), verify=False):
     chunk1_path = os.path.join(from_folder, CHNUK1_NAME)
     if not os.path.exists(chunk1_path):
-        print(f"Can't find {chunk1_path}")
-        return
+        raise FileNotFoundError(f"Can't find {chunk1_path}")
 
+    timings = Stages()
+    timings.start()
     new_file_content = b''
     with open(chunk1_path, 'rb') as f:
         new_file_content += f.read()
 
-    for _bytes in pack_databases(from_folder):
+    packed = pack_databases(from_folder)
+    for _bytes in packed:
         new_file_content += _bytes
+    timings.stop('deflate')
 
-    with open(to_file, 'wb') as f:
+    verifier = SaveVerifier() if verify else None
+    timings.start()
+    with atomic_write(to_file, [verifier, *before_replace] if verifier else before_replace) as f:
         f.write(new_file_content)
+    timings.stop('write')
+
+    db_sizes = [struct.unpack("I", _bytes)[0] for _bytes in packed[1:4]]
+    return RepackResult(
+        zlib_size=struct.unpack("I", packed[0])[0],
+        db_sizes=dict(zip((MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME), db_sizes)),
+        timings=timings,
+        verified=verifier.result if verifier else None
+    )
+
+
+def write_save(to_file, chunk1, dbs, level=zlib.Z_DEFAULT_COMPRESSION, workers=1, before_replace=(), verify=False):
+    # dbs are the three databases in save order, any bytes-like object (mmap, bytes, bytearray).
+    # before_replace hooks (e.g. savefile.SaveBackup) run on the finished file before it replaces to_file,
+    # verify checks it first with verify.verify_save and raises VerifyError instead of installing a bad save.
+    if workers > 1:
+        compressed = iter_deflate_parallel([db for db in dbs if len(db)], workers, level)
+    else:
+        compressed = iter_deflate([db for db in dbs if len(db)], level=level)
+
+    timings = Stages()
+    timings.start()
+    db_crcs = [zlib.crc32(db) for db in dbs]
+    timings.stop('crc')
+
+    verifier = SaveVerifier(dict(zip((MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME), db_crcs))) if verify else None
+    timings.start()
+    # written next to to_file and renamed over it once complete, see savefile.atomic_write
+    with atomic_write(to_file, [verifier, *before_replace] if verifier else before_replace) as f:
+        f.write(chunk1)
+
+        # Compressed size is unknown until the stream is finished, backpatched below.
+        zlib_sz_off = f.tell()
+        f.write(struct.pack("I", 0))
+        for db in dbs:
+            f.write(struct.pack("I", len(db)))
+
+        zlib_sz = 0
+        for _bytes in compressed:
+            f.write(_bytes)
+            zlib_sz += len(_bytes)
+
+        f.seek(zlib_sz_off)
+        f.write(struct.pack("I", zlib_sz))
+    timings.stop('deflate_write')
+
+    return RepackResult(
+        zlib_size=zlib_sz,
+        db_sizes=dict(zip((MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME), map(len, dbs))),
+        timings=timings,
+        db_crcs=dict(zip((MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME), db_crcs)),
+        verified=verifier.result if verifier else None
+    )
+
+
+def do_pack_stream(from_folder, to_file, chunk1=None, level=zlib.Z_DEFAULT_COMPRESSION, workers=1, backups=None, before_replace=(), verify=False):
+    # chunk1 can be handed over from a previous UnpackResult to skip reading it back,
+    # backups from a selective unpack are compressed from memory instead of the folder.
+    if chunk1 is None:
+        chunk1_path = os.path.join(from_folder, CHNUK1_NAME)
+        if not os.path.exists(chunk1_path):
+            raise FileNotFoundError(f"Can't find {chunk1_path}")
+        with open(chunk1_path, 'rb') as f:
+            chunk1 = f.read()
+
+    if backups is not None:
+        mmaps = [get_db_mmap(os.path.join(from_folder, MAIN_DB_NAME)), backups[BACKUP_DB_NAME], backups[BACKUP_DB2_NAME]]
+    else:
+        mmaps = [
+            get_db_mmap(os.path.join(from_folder, MAIN_DB_NAME)),
+            get_db_mmap(os.path.join(from_folder, BACKUP_DB_NAME)),
+            get_db_mmap(os.path.join(from_folder, BACKUP_DB2_NAME))
+        ]
+    return write_save(to_file, chunk1, mmaps, level, workers, before_replace, verify)
+
+
+def do_pack_memory(chunk1, dbs, to_file, level=zlib.Z_DEFAULT_COMPRESSION, workers=1, before_replace=(), verify=False):
+    return write_save(to_file, chunk1, dbs, level, workers, before_replace, verify)
 
 
-def do_unpack(from_file, to_folder):
+def read_db_header(mm, path=None):
+    # Parses chunk1 to jump to the DB section (cached per file), falls back to the "None None" scan.
+    db_section_off, header_source = find_db_section(mm, path)
+
+    zlib_sz, *db_sizes = struct.unpack_from('iiii', mm, db_section_off)
+    return db_section_off, zlib_sz, db_sizes, header_source
+
+
+def do_unpack(from_file, to_folder, stream=False, cache=None, selective=False, spill_size=SPILL_SIZE):
+    # selective only writes main.db, the backups are kept in result.buffers for process_repack(backups=...)
+    timings = Stages()
+    timings.start()
     with open(from_file, 'rb') as f:
         mm = mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
 
-    # None None just before the packed DB Section.
-    none_none_sig = b'\x00\x05\x00\x00\x00\x4E\x6F\x6E\x65\x00\x05\x00\x00\x00\x4E\x6F\x6E\x65\x00'
-
-    db_section_off = mm.find(none_none_sig) + len(none_none_sig)
-    db_section_off += 4  # Unk 4 Bytes
+    db_section_off, zlib_sz, db_sizes, header_source = read_db_header(mm, from_file)
+    timings.stop('find_header')
 
     # Part of the file that we ignore as it's not database
     # But we need it later to "pack" new save
+    chunk1 = mm.read(db_section_off)
     with open(os.path.join(to_folder, CHNUK1_NAME), 'wb') as f:
-        f.write(mm.read(db_section_off))
-
-    zlib_sz = struct.unpack('i', mm.read(4))[0]
+        f.write(chunk1)
+    mm.seek(db_section_off + 16)
+
+    databases = dict(zip(
+        [os.path.join(to_folder, name) for name in (MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME)],
+        db_sizes
+    ))
+
+    result = UnpackResult(
+        db_section_off=db_section_off,
+        zlib_size=zlib_sz,
+        db_sizes={os.path.basename(dump_name): db_size for dump_name, db_size in databases.items()},
+        chunk1=chunk1,
+        timings=timings,
+        header_source=header_source
+    )
 
-    databases = {
-        os.path.join(to_folder, MAIN_DB_NAME): struct.unpack('i', mm.read(4))[0],
-        os.path.join(to_folder, BACKUP_DB_NAME): struct.unpack('i', mm.read(4))[0],
-        os.path.join(to_folder, BACKUP_DB2_NAME): struct.unpack('i', mm.read(4))[0]
-    }
+    if cache is not None:
+        timings.start()
+        key = cache.key(mm, db_section_off, zlib_sz)
+        timings.stop('hash')
+        timings.start()
+        cached = cache.copy_to(key, result.db_sizes, to_folder, [MAIN_DB_NAME] if selective else None)
+        if cached is not None:
+            if selective:
+                # empty backups are stored as empty files, which can't be mmapped
+                result.buffers = {name: get_db_mmap(os.path.join(cached, name)) if result.db_sizes[name] > 0 else bytearray()
+                                  for name in (BACKUP_DB_NAME, BACKUP_DB2_NAME)}
+            timings.stop('cache_copy')
+            result.cache = 'hit'
+            return result
+        result.cache = 'miss'
+
+    timings.start()
+    if selective:
+        main_path = os.path.join(to_folder, MAIN_DB_NAME)
+        backups = create_dbs_selective(main_path, db_sizes, iter_inflate(mm, mm.tell()), spill_size)
+        result.buffers = dict(zip((BACKUP_DB_NAME, BACKUP_DB2_NAME), backups))
+        timings.stop('inflate_write')
+        if cache is not None:
+            cache_put(cache, key, timings, {MAIN_DB_NAME: main_path, **result.buffers})
+        return result
+
+    if stream:
+        # Inflate straight into the target files instead of building the whole blob.
+        create_dbs_stream(databases, iter_inflate(mm, mm.tell()))
+        timings.stop('inflate_write')
+        if cache is not None:
+            cache_put(cache, key, timings, {os.path.basename(path): path for path in databases})
+        return result
 
     decompressed_dbs = zlib.decompress(mm.read())
+    timings.stop('inflate')
 
+    timings.start()
     _start = 0
     for dump_name, db_size in databases.items():
         # print(f'{dump_name}:{db_size}')
@@ -100,29 +479,114 @@ def do_unpack(from_file, to_folder):
             break
         create_db(dump_name, decompressed_dbs, _start, _start+db_size)
         _start += db_size
+    timings.stop('write')
+    if cache is not None:
+        cache_put(cache, key, timings, {os.path.basename(path): path for path in databases})
+    return result
 
 
-def process_unpack(input_file, result_dir):
+def cache_put(cache, key, timings, sources):
+    timings.start()
+    cache.put(key, sources)
+    timings.stop('cache_store')
+
+
+def do_unpack_memory(from_file, cache=None):
+    # Same as do_unpack but the databases stay in memory, nothing is written to disk.
+    timings = Stages()
+    timings.start()
+    with open(from_file, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
+
+    db_section_off, zlib_sz, db_sizes, header_source = read_db_header(mm, from_file)
+    timings.stop('find_header')
+    names = (MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME)
+
+    cached = None
+    if cache is not None:
+        timings.start()
+        key = cache.key(mm, db_section_off, zlib_sz)
+        timings.stop('hash')
+        timings.start()
+        cached = cache.read(key, dict(zip(names, db_sizes)))
+        if cached is not None:
+            timings.stop('cache_read')
+
+    if cached is None:
+        timings.start()
+        buffers = create_dbs_memory(db_sizes, iter_inflate(mm, db_section_off + 16))
+        timings.stop('inflate')
+        if cache is not None:
+            cache_put(cache, key, timings, dict(zip(names, buffers)))
+    else:
+        buffers = [cached[name] for name in names]
+
+    result = UnpackResult(
+        db_section_off=db_section_off,
+        zlib_size=zlib_sz,
+        db_sizes=dict(zip((MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME), db_sizes)),
+        chunk1=mm[:db_section_off],
+        timings=timings,
+        header_source=header_source,
+        buffers=dict(zip(names, buffers)),
+        cache=None if cache is None else 'miss' if cached is None else 'hit'
+    )
+    mm.close()
+    return result
+
+
+def process_unpack(input_file, result_dir, stream=False, cache=None, selective=False):
     if not os.path.exists(input_file):
-        print(f"Can't find {input_file}")
-        return
+        raise FileNotFoundError(f"Can't find {input_file}")
 
     if not os.path.exists(result_dir):
         os.makedirs(result_dir)
 
-    do_unpack(input_file, result_dir)
+    return do_unpack(input_file, result_dir, stream, cache, selective)
+
+
+def process_repack(input_dir, result_file, stream=False, chunk1=None, level=zlib.Z_DEFAULT_COMPRESSION, workers=1, backups=None, before_replace=(), verify=False):
+    # A non default level, several workers or in-memory backups always go through the streaming writer.
+    if stream or workers > 1 or level != zlib.Z_DEFAULT_COMPRESSION or backups is not None:
+        return do_pack_stream(input_dir, result_file, chunk1, level, workers, backups, before_replace, verify)
+    return do_pack(input_dir, result_file, before_replace, verify)
+
+
+def process_unpack_memory(input_file, cache=None):
+    if not os.path.exists(input_file):
+        raise FileNotFoundError(f"Can't find {input_file}")
 
+    return do_unpack_memory(input_file, cache)
 
-def process_repack(input_dir, result_file):
-    do_pack(input_dir, result_file)
 
+def process_repack_memory(chunk1, dbs, result_file, level=zlib.Z_DEFAULT_COMPRESSION, workers=1, before_replace=(), verify=False):
+    return do_pack_memory(chunk1, dbs, result_file, level, workers, before_replace, verify)
 
-def main(operation, input_path, res_path):
+
+def dump_unpacked(unpacked, result_dir):
+    # Writes an in-memory unpack out the way do_unpack lays it on disk, for debugging.
+    if not os.path.exists(result_dir):
+        os.makedirs(result_dir)
+
+    with open(os.path.join(result_dir, CHNUK1_NAME), 'wb') as f:
+        f.write(unpacked.chunk1)
+    for name, buffer in unpacked.buffers.items():
+        if len(buffer) == 0:
+            break
+        with open(os.path.join(result_dir, name), 'wb') as f:
+            f.write(buffer)
+
+
+def main(operation, input_path, res_path, stream=False, level=zlib.Z_DEFAULT_COMPRESSION, workers=1, cache=False):
     # python script.py --operation unpack --input autosave.sav --result result
-    if operation == "unpack":
-        process_unpack(input_path, res_path)
-    elif operation == "repack":
-        process_repack(input_path, res_path)
+    try:
+        if operation == "unpack":
+            print(process_unpack(input_path, res_path, stream, DBCache() if cache else None))
+        elif operation == "repack":
+            print(process_repack(input_path, res_path, stream, level=level, workers=workers))
+    except FileNotFoundError as e:
+        print(e)
+        raise SystemExit(1)
 
 
 if __name__ == '__main__':
@@ -138,5 +602,22 @@ if __name__ == '__main__':
         help='Full path to the result file. (to directory for unpack, or to file for repack)',
         required=True
     )
+    parser.add_argument(
+        '--stream',
+        help='Stream the databases through zlib with bounded memory instead of building the payload in memory.',
+        action='store_true'
+    )
+    parser.add_argument('--level', help='zlib compression level (repack only).', type=int, default=zlib.Z_DEFAULT_COMPRESSION)
+    parser.add_argument(
+        '--workers',
+        help='Deflate threads for repack, 1 keeps the single zlib stream compressor, 0 uses every core.',
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        '--cache',
+        help='Reuse databases decompressed earlier from the same save content (unpack only), see dbcache.py.',
+        action='store_true'
+    )
     args = parser.parse_args()
-    main(args.operation, args.input, args.result)
+    main(args.operation, args.input, args.result, args.stream, args.level, args.workers or os.cpu_count(), args.cache)
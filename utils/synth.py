@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import struct
+import tempfile
+import zlib
+
+try:
+    from .header import NONE_NONE_SIG
+except ImportError:
+    # run as a plain script from the utils folder
+    from header import NONE_NONE_SIG
+
+# Synthetic saves in the layout do_unpack expects, for benchmarks and for trying changes without a real save.
+# Only the tables and columns SeasonChanger touches exist, filled with plausible random values.
+
+DRIVERS_JSON = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drivers', 'F1_22.json')
+
+SCHEMA = '''
+CREATE TABLE Tyres(Type INTEGER, Durability REAL, Grip REAL, TempIncRate REAL, TempDecRate REAL,
+                   MinExtremeWear REAL, MaxExtremeWear REAL, MinOptimalWear REAL, MaxOptimalWear REAL,
+                   MinOptimalGrip REAL, MaxOptimalGrip REAL, MinExtremeGrip REAL, MaxExtremeGrip REAL);
+CREATE TABLE Parts_RaceSimConstants(DirtyAirLowSpeedMultiplier REAL, DirtyAirMediumSpeedMultiplier REAL,
+                                    DirtyAirHighSpeedMultiplier REAL, MaxDRSTopSpeedMultiplier REAL,
+                                    MaxDRSAccelerationMultiplier REAL, MinDRSAccelerationMultiplier REAL,
+                                    DirtyAirStraightSpeedMultiplier REAL);
+CREATE TABLE Staff_DriverData(StaffID INTEGER PRIMARY KEY, DriverCode TEXT, Improvability INTEGER, Aggression INTEGER);
+CREATE TABLE Staff_PerformanceStats(StaffID INTEGER, StatID INTEGER, Val REAL, PRIMARY KEY(StaffID, StatID));
+CREATE TABLE Staff_PitCrew_PerformanceStats(StaffID INTEGER, StatID INTEGER, Val REAL);
+CREATE TABLE Finance_TeamBalance(TeamID INTEGER PRIMARY KEY, Balance INTEGER);
+CREATE TABLE Parts_Enum_EngineManufacturers(Value INTEGER PRIMARY KEY, Name TEXT, EngineDesignID INTEGER,
+                                            ErsDesignID INTEGER, GearboxDesignID INTEGER);
+CREATE TABLE Parts_DesignStatValues(DesignID INTEGER, StatID INTEGER, Value REAL, UnitValue REAL,
+                                    PRIMARY KEY(DesignID, StatID));
+CREATE TABLE Parts_Designs(DesignID INTEGER PRIMARY KEY, PartType INTEGER, TeamID INTEGER);
+CREATE TABLE Races_TeamPerformance(TeamID INTEGER, TrackID INTEGER, Straights REAL, SlowCorners REAL,
+                                   FastCorners REAL, MediumCorners REAL);
+CREATE TABLE Parts_TeamExpertise(TeamID INTEGER, PartType INTEGER, Expertise REAL, SeasonStartExpertise REAL);
+'''
+
+TEAMS = 10
+TRACKS = 23
+ENGINE_MANUFACTURERS = 4
+PART_TYPES = 6
+TYRE_TYPES = 6
+# driver stats are StatID 2..10, see ratings.DriverStats
+STAT_IDS = range(2, 11)
+DESIGN_STATS = 10
+
+
+def driver_codes(count):
+    # the real codes first so --ratings files resolve, made up ones after that
+    try:
+        with open(DRIVERS_JSON, 'r') as f:
+            codes = [entry['ID'] for entry in json.load(f)]
+    except (OSError, ValueError):
+        codes = list()
+    codes += [f'X{i}' for i in range(len(codes), count)]
+    return [f'[DriverCode_{code.lower().capitalize()}]' for code in codes[:count]]
+
+
+def make_db(path, drivers=200, seed=0):
+    # drivers scales the whole database: staff stats, pit crew and 2 part designs per driver
+    rng = random.Random(seed)
+    con = sqlite3.connect(path)
+    con.executescript(SCHEMA)
+
+    con.executemany('INSERT INTO Tyres VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?);',
+                    [(t, *(rng.random() for _ in range(12))) for t in range(TYRE_TYPES)])
+    con.execute('INSERT INTO Parts_RaceSimConstants VALUES (0.9, 0.9, 0.9, 1.1, 1.1, 1.0, 1.0);')
+    con.executemany('INSERT INTO Staff_DriverData VALUES (?,?,?,?);',
+                    [(i, code, rng.randint(20, 80), rng.randint(20, 80)) for i, code in enumerate(driver_codes(drivers))])
+    con.executemany('INSERT INTO Staff_PerformanceStats VALUES (?,?,?);',
+                    [(i, stat, rng.randint(30, 90)) for i in range(drivers) for stat in STAT_IDS])
+    con.executemany('INSERT INTO Staff_PitCrew_PerformanceStats VALUES (?,?,?);',
+                    [(i, stat, rng.randint(30, 90)) for i in range(drivers) for stat in STAT_IDS])
+    con.executemany('INSERT INTO Finance_TeamBalance VALUES (?,?);',
+                    [(team, rng.randint(10, 200) * 1000000) for team in range(TEAMS)])
+    con.executemany('INSERT INTO Races_TeamPerformance VALUES (?,?,?,?,?,?);',
+                    [(team, track, *(rng.uniform(0.8, 1.2) for _ in range(4))) for team in range(TEAMS) for track in range(TRACKS)])
+    expertise = [(team, part, rng.uniform(100, 1000)) for team in range(TEAMS) for part in range(PART_TYPES)]
+    con.executemany('INSERT INTO Parts_TeamExpertise VALUES (?,?,?,?);',
+                    [(team, part, value, value) for team, part, value in expertise])
+    con.executemany('INSERT INTO Parts_Enum_EngineManufacturers VALUES (?,?,?,?,?);',
+                    [(m, f'Manufacturer{m}', m * 3, m * 3 + 1, m * 3 + 2) for m in range(ENGINE_MANUFACTURERS)])
+    con.executemany('INSERT INTO Parts_Designs VALUES (?,?,?);',
+                    [(design, design % PART_TYPES, design % TEAMS) for design in range(drivers * 2)])
+    con.executemany('INSERT INTO Parts_DesignStatValues VALUES (?,?,?,?);',
+                    [(design, stat, rng.uniform(0, 100), rng.random()) for design in range(drivers * 2) for stat in range(DESIGN_STATS)])
+    con.commit()
+    con.close()
+
+
+def fstring(value):
+    data = value.encode('latin-1') + b'\x00'
+    return struct.pack('<i', len(data)) + data
+
+
+def make_property(name, prop_type, value, extra=b''):
+    return fstring(name) + fstring(prop_type) + struct.pack('<ii', len(value), 0) + extra + b'\x00' + value
+
+
+def make_chunk1(rng, save_slot='autosave', decoy=True):
+    # GVAS header and a small property list ending in None None, the way the game writes chunk1.
+    out = b'GVAS' + struct.pack('<ii', 2, 522) + struct.pack('<HHHI', 4, 26, 2, 0) + fstring('++UE4+Release-4.26')
+    out += struct.pack('<ii', 3, 1) + rng.randbytes(16) + struct.pack('<i', 7)
+    out += fstring('/Script/F1Manager.F1SaveGame')
+    out += make_property('SaveSlot', 'StrProperty', fstring(save_slot))
+    out += make_property('Day', 'IntProperty', struct.pack('<i', 44900 + rng.randint(0, 365)))
+    if decoy:
+        # a struct that happens to contain the None None bytes, the header parser has to skip it
+        blob = NONE_NONE_SIG + rng.randbytes(100)
+        out += make_property('Meta', 'StructProperty', blob, extra=fstring('Blob') + rng.randbytes(16))
+    out += fstring('None') + fstring('None') + b'\x00\x00\x00\x00'
+    return out
+
+
+def make_save(path, drivers=200, seed=0, level=zlib.Z_DEFAULT_COMPRESSION, decoy=True):
+    # Returns the database sizes, main.db and the two backups are built from different seeds.
+    rng = random.Random(seed)
+    dbs = list()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i in range(3):
+            db_path = os.path.join(tmp_dir, f'{i}.db')
+            make_db(db_path, drivers, seed + i)
+            with open(db_path, 'rb') as f:
+                dbs.append(f.read())
+
+    compressed = zlib.compress(b''.join(dbs), level)
+    with open(path, 'wb') as f:
+        f.write(make_chunk1(rng, os.path.splitext(os.path.basename(path))[0], decoy))
+        f.write(struct.pack('I', len(compressed)))
+        for db in dbs:
+            f.write(struct.pack('I', len(db)))
+        f.write(compressed)
+    return [len(db) for db in dbs]
+
+
+if __name__ == '__main__':
+    # python utils/synth.py --output synthetic.sav --drivers 2000
+    parser = argparse.ArgumentParser(description='Generate a synthetic F1 Manager 2022 save.')
+    parser.add_argument('--output', help='Path of the save to write.', required=True)
+    parser.add_argument('--drivers', help='Scale of the databases, staff rows (designs are twice that).', type=int, default=200)
+    parser.add_argument('--seed', help='Random seed, the same seed gives the same save.', type=int, default=0)
+    parser.add_argument('--level', help='zlib compression level.', type=int, default=zlib.Z_DEFAULT_COMPRESSION)
+    parser.add_argument('--no_decoy', help='Leave out the struct property that mimics the None None signature.', action='store_true')
+    args = parser.parse_args()
+
+    sizes = make_save(args.output, args.drivers, args.seed, args.level, not args.no_decoy)
+    print(f"Wrote {args.output}: {os.path.getsize(args.output)} bytes, databases {sizes}")
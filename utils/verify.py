@@ -0,0 +1,205 @@
+import argparse
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import zlib
+from dataclasses import dataclass, field
+
+try:
+    from .header import find_db_section, HeaderError
+    from .instrument import Stages
+except ImportError:
+    # run as a plain script from the utils folder
+    from header import find_db_section, HeaderError
+    from instrument import Stages
+
+# Re-reads a written save the way the game will: one incremental inflate in CHUNK_SIZE steps, the adler32
+# trailer and the per-DB sizes checked against the header, a crc32 per database compared with the one taken
+# before the repack, and sqlite's quick_check on main.db, which is spilled to a temporary file as it streams
+# by and checked on a thread while the backups are still inflating.
+
+CHUNK_SIZE = 1 << 20
+DB_NAMES = ('main.db', 'backup1.db', 'backup2.db')
+# sqlite file header bytes 18/19, WAL (2) would make sqlite look for a -wal file next to the spilled copy
+WAL_HEADER = b'\x02\x02'
+LEGACY_HEADER = b'\x01\x01'
+
+
+@dataclass
+class VerifyResult:
+    ok: bool
+    errors: list = field(default_factory=list)
+    db_sizes: dict = field(default_factory=dict)
+    db_crcs: dict = field(default_factory=dict)
+    # 'ok' or the problems sqlite reported, None when main.db was not checked
+    quick_check: str = None
+    timings: dict = field(default_factory=dict)
+
+
+class VerifyError(ValueError):
+
+    def __init__(self, result):
+        super().__init__(f"written save failed verification: {'; '.join(result.errors)}")
+        self.result = result
+
+
+class SaveVerifier:
+    # atomic_write hook running verify_save on the finished temporary file, a save failing it raises
+    # VerifyError before the rename and is never installed over the old one.
+
+    def __init__(self, expected_crcs=None):
+        self.expected_crcs = expected_crcs
+        self.result = None
+
+    def __call__(self, tmp_path):
+        self.result = verify_save(tmp_path, self.expected_crcs)
+        if not self.result.ok:
+            raise VerifyError(self.result)
+
+
+def quick_check(path, thorough=False, out=None):
+    # runs on its own thread, so it opens its own connection
+    con = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = con.execute('PRAGMA integrity_check;' if thorough else 'PRAGMA quick_check;').fetchall()
+        result = '; '.join(str(row[0]) for row in rows)
+    except sqlite3.DatabaseError as e:
+        result = str(e)
+    finally:
+        con.close()
+    if out is not None:
+        out.append(result)
+    return result
+
+
+def inflate_checked(mm, start, end, chunk_size=CHUNK_SIZE):
+    # Yields the inflated pieces of mm[start:end], raises zlib.error when the stream doesn't end exactly at end
+    # or its adler32 trailer doesn't match the data.
+    decompressor = zlib.decompressobj()
+    adler = 1
+    view = memoryview(mm)
+    try:
+        for pos in range(start, end, chunk_size):
+            buf = view[pos:min(pos + chunk_size, end)]
+            while buf:
+                out = decompressor.decompress(buf, chunk_size)
+                if out:
+                    adler = zlib.adler32(out, adler)
+                    yield out
+                buf = decompressor.unconsumed_tail
+            if decompressor.eof:
+                break
+        out = decompressor.flush()
+        if out:
+            adler = zlib.adler32(out, adler)
+            yield out
+    finally:
+        view.release()
+
+    if not decompressor.eof:
+        raise zlib.error('zlib stream is cut off before its end')
+    if decompressor.unused_data or pos + chunk_size < end:
+        raise zlib.error('zlib stream ends before the size the header gives it')
+    trailer = struct.unpack('>I', mm[end - 4:end])[0]
+    if trailer != adler:
+        raise zlib.error(f'adler32 mismatch: trailer {trailer:08x}, data {adler:08x}')
+
+
+def start_check(main_path, thorough, out):
+    with open(main_path, 'r+b') as f:
+        f.seek(18)
+        if f.read(2) == WAL_HEADER:
+            f.seek(18)
+            f.write(LEGACY_HEADER)
+    checker = threading.Thread(target=quick_check, args=(main_path, thorough, out), daemon=True)
+    checker.start()
+    return checker
+
+
+def verify_save(path, expected_crcs=None, check_main=True, thorough=False, chunk_size=CHUNK_SIZE):
+    # expected_crcs: {db name: crc32} of the databases handed to the repack (RepackResult.db_crcs)
+    timings = Stages()
+    result = VerifyResult(ok=False, timings=timings)
+    timings.start()
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
+    try:
+        try:
+            db_section_off, _ = find_db_section(mm)
+            zlib_sz, *db_sizes = struct.unpack_from('<iiii', mm, db_section_off)
+        except (HeaderError, struct.error) as e:
+            result.errors.append(f'header: {e}')
+            return result
+        timings.stop('header')
+        start = db_section_off + 16
+        end = start + zlib_sz
+        if zlib_sz <= 0 or end != len(mm):
+            result.errors.append(f'header gives {zlib_sz} compressed bytes, the file holds {len(mm) - start}')
+            return result
+
+        timings.start()
+        with tempfile.TemporaryDirectory(prefix='f1verify-') as tmp_dir:
+            main_path = os.path.join(tmp_dir, DB_NAMES[0])
+            spill = open(main_path, 'wb') if check_main and db_sizes[0] > 0 else None
+            checker = None
+            checked = list()
+            sizes = [0] * len(db_sizes)
+            crcs = [0] * len(db_sizes)
+            index = 0
+            try:
+                for piece in inflate_checked(mm, start, end, chunk_size):
+                    piece = memoryview(piece)
+                    while piece:
+                        while index < len(db_sizes) and sizes[index] == db_sizes[index]:
+                            index += 1
+                        if index == len(db_sizes):
+                            raise ValueError(f'{len(piece)} bytes more than the header sizes add up to')
+                        part = piece[:db_sizes[index] - sizes[index]]
+                        sizes[index] += len(part)
+                        crcs[index] = zlib.crc32(part, crcs[index])
+                        if index == 0 and spill is not None:
+                            spill.write(part)
+                            if sizes[0] == db_sizes[0]:
+                                spill.close()
+                                checker = start_check(main_path, thorough, checked)
+                        piece = piece[len(part):]
+            except (zlib.error, ValueError) as e:
+                result.errors.append(f'stream: {e}')
+            finally:
+                if spill is not None and not spill.closed:
+                    spill.close()
+                if checker is not None:
+                    checker.join()
+            timings.stop('inflate_check')
+
+        result.db_sizes = dict(zip(DB_NAMES, sizes))
+        result.db_crcs = dict(zip(DB_NAMES, crcs))
+        for name, size, expected in zip(DB_NAMES, sizes, db_sizes):
+            if size != expected:
+                result.errors.append(f'{name}: {size} bytes inflated, the header says {expected}')
+        for name, expected in (expected_crcs or {}).items():
+            if result.db_crcs.get(name) != expected:
+                result.errors.append(f'{name}: crc32 {result.db_crcs.get(name, 0):08x} differs from the repacked database {expected:08x}')
+        if checked:
+            result.quick_check = checked[0]
+            if checked[0] != 'ok':
+                result.errors.append(f'main.db: {checked[0]}')
+        result.ok = not result.errors
+        return result
+    finally:
+        mm.close()
+
+
+if __name__ == '__main__':
+    # python utils/verify.py --input autosave.sav
+    parser = argparse.ArgumentParser(description='Check that an F1 Manager 2022 save inflates and its main.db is sound.')
+    parser.add_argument('--input', help='Full path to the save file to check.', required=True)
+    parser.add_argument('--integrity', help='Run the full integrity_check instead of quick_check.', action='store_true')
+    args = parser.parse_args()
+
+    verified = verify_save(args.input, thorough=args.integrity)
+    print(verified)
+    raise SystemExit(0 if verified.ok else 1)
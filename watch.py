@@ -0,0 +1,242 @@
+import argparse
+import contextlib
+import ctypes
+import ctypes.util
+import fnmatch
+import mmap
+import os
+import select
+import struct
+import sys
+import tempfile
+import time
+
+import config as cfg
+from batch import modify_save
+from main import MODIFIERS, add_season_args, season_kwargs_from_args
+from utils.header import find_db_section, HeaderError
+from utils.savefile import signature, SaveChanged
+
+# inotify(7) event bits, a save counts as changed when it is closed after writing or renamed into the folder
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+EVENT_HEADER = struct.Struct('iIII')
+
+# a save is only modded once no event came in for this long and its size header says it is complete
+DEBOUNCE = 2.0
+POLL_INTERVAL = 1.0
+
+# modifiers that add to what the save already holds, re-applied on every autosave they would compound
+COMPOUNDING = ('team_cash_infusion',)
+WATCH_MODIFIERS = tuple(name for name in MODIFIERS if name not in COMPOUNDING)
+
+
+class InotifyWatcher:
+    # Linux only, through libc with ctypes so nothing has to be installed.
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.folder = folder
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f'inotify_add_watch failed on {folder}')
+
+    def changes(self, timeout=None):
+        # names written or moved into the folder within timeout seconds (None blocks until one is)
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        names = set()
+        if not ready:
+            return names
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return names
+        pos = 0
+        while pos < len(data):
+            _wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip(b'\x00')
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped, treat every file as changed
+                names.update(os.listdir(self.folder))
+            elif name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    # Fallback for Windows/macOS or when inotify is unavailable: compares size and mtime every interval.
+
+    def __init__(self, folder, interval=POLL_INTERVAL):
+        self.folder = folder
+        self.interval = interval
+        self.seen = self.scan()
+
+    def scan(self):
+        seen = dict()
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    seen[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return seen
+
+    def changes(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        seen = self.scan()
+        names = {name for name, signature in seen.items() if self.seen.get(name) != signature}
+        self.seen = seen
+        return names
+
+    def close(self):
+        pass
+
+
+def open_watcher(folder, poll=False, interval=POLL_INTERVAL):
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}), polling every {interval}s instead")
+    return PollingWatcher(folder, interval)
+
+
+def save_complete(path):
+    # The game writes the DB section last, the save is complete once the file holds the whole zlib stream.
+    try:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return False  # gone again or still empty
+    try:
+        db_section_off, _ = find_db_section(mm)
+        zlib_sz = struct.unpack_from('<i', mm, db_section_off)[0]
+        return zlib_sz > 0 and len(mm) >= db_section_off + 16 + zlib_sz
+    except (HeaderError, struct.error):
+        return False
+    finally:
+        mm.close()
+
+
+class SaveWatcher:
+    # Re-applies one season profile to every matching save the game writes, in this process so the
+    # parsed ratings, parts balance and tyre settings are built once.
+
+    def __init__(self, folder, season_kwargs, patterns=('autosave.sav',), debounce=DEBOUNCE, poll=False,
+                 interval=POLL_INTERVAL, modifiers=WATCH_MODIFIERS, verbose=False, **options):
+        self.folder = folder
+        self.season_kwargs = season_kwargs
+        parts_balance = season_kwargs.get('parts_balance')
+        if parts_balance is not None and parts_balance.compounds():
+            self.log("The handicaps would scale the save's own design values again on every autosave "
+                     "(no designs values are set), they are left out")
+            parts_balance.balance['handicaps'] = {}
+        self.patterns = patterns
+        self.debounce = debounce
+        self.modifiers = modifiers
+        self.verbose = verbose
+        # modify_save settings: profile, level, compress_workers, keep_backups
+        self.options = options
+        self.watcher = open_watcher(folder, poll, interval)
+        # path -> signature of the save we wrote, so our own repack doesn't trigger another run
+        self.written = dict()
+        # path -> (first event, last event)
+        self.pending = dict()
+
+    def log(self, message):
+        print(f"[{time.strftime('%H:%M:%S')}] {message}", flush=True)
+
+    def matches(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns)
+
+    def collect(self, timeout):
+        names = self.watcher.changes(timeout)
+        now = time.time()
+        for name in names:
+            path = os.path.join(self.folder, name)
+            if not self.matches(name):
+                continue
+            current = signature(path)
+            if current is None or self.written.get(path) == current:
+                continue
+            first, _ = self.pending.get(path, (now, now))
+            self.pending[path] = (first, now)
+
+    def process(self, path, expected):
+        # the save is only replaced while it still has the signature it had before the unpack
+        with contextlib.ExitStack() as stack:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix='f1watch-'))
+            if not self.verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+            return modify_save(path, path, work_dir, self.season_kwargs, self.modifiers, expect=expected, **self.options)
+
+    def step(self):
+        # waits for events, then mods every save that has been quiet for the debounce time
+        self.collect(self.debounce if self.pending else None)
+        now = time.time()
+        for path, (first, last) in list(self.pending.items()):
+            if now - last < self.debounce:
+                continue
+            if not save_complete(path):
+                # still being written, look again after another debounce
+                self.pending[path] = (first, now)
+                continue
+            del self.pending[path]
+            expected = signature(path)
+            if expected is None:
+                continue
+            saved = expected[2] / 1e9
+            try:
+                result = self.process(path, expected)
+            except SaveChanged:
+                # the game saved again while this run was going, drop it and mod the newer save instead
+                self.log(f"{os.path.basename(path)} changed during the run, result dropped and queued again")
+                self.pending[path] = (first, time.time())
+                continue
+            except Exception as e:
+                self.log(f"{os.path.basename(path)} failed: {type(e).__name__}: {e}")
+                continue
+            self.written[path] = signature(path)
+            done = time.time()
+            stages = '  '.join(f'{stage} {seconds * 1000:.0f}ms' for stage, seconds in result['timings'].items())
+            self.log(f"{os.path.basename(path)} modded {done - saved:.2f}s after the game saved it "
+                     f"({done - first:.2f}s after the first event, {result['writes']} writes)  {stages}")
+
+    def run(self):
+        kind = 'inotify' if isinstance(self.watcher, InotifyWatcher) else 'polling'
+        self.log(f"Watching {self.folder} for {', '.join(self.patterns)} ({kind}), Ctrl+C to stop")
+        try:
+            while True:
+                self.step()
+        except KeyboardInterrupt:
+            self.log("Stopped")
+        finally:
+            self.watcher.close()
+
+
+if __name__ == '__main__':
+    # python watch.py --saves autosave.sav "*.sav"
+    parser = argparse.ArgumentParser(description='Re-apply the season profile every time the game saves')
+    parser.add_argument('--saves', nargs='+', default=['autosave.sav'], help='save names or globs in the save folder to watch')
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE, help='seconds a save has to be left alone before it is modded')
+    parser.add_argument('--poll', action='store_true', help='poll the save folder instead of using inotify')
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help='seconds between two scans when polling')
+    parser.add_argument('--verbose', action='store_true', help='print the modifier output of every run')
+    parser.add_argument('--modifiers', nargs='+', choices=MODIFIERS, default=WATCH_MODIFIERS,
+                        help=f"modifiers to re-apply, by default all but {', '.join(COMPOUNDING)} which would compound on every save")
+    add_season_args(parser)
+    ARGS = parser.parse_args()
+
+    watcher = SaveWatcher(cfg.save_folder, season_kwargs_from_args(ARGS), ARGS.saves, ARGS.debounce, ARGS.poll, ARGS.interval,
+                          ARGS.modifiers, verbose=ARGS.verbose, profile=ARGS.db_profile, level=ARGS.compress_level,
+                          compress_workers=ARGS.compress_workers or os.cpu_count(), keep_backups=cfg.save_backups)
+    watcher.run()